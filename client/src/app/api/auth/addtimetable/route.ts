@@ -1,13 +1,13 @@
 import { NextRequest, NextResponse } from "next/server";
-import { pinnedApi } from "@/lib/pinnedClient";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
 
 export async function POST(req: NextRequest) {
   const body = await req.json();
   try {
-    const flaskRes = await pinnedApi.post("/api/addtimetable", body);
+    const flaskRes = await pinnedApi.post("/api/addtimetable", body, { headers: sessionHeaders(req) });
     return NextResponse.json(flaskRes.data, { status: flaskRes.status });
   } catch (err: any) {
-    return NextResponse.json({ error: err.message }, {
+    return NextResponse.json({ error: err.response?.data?.error || err.message }, {
       status: err.response?.status || 500
     });
   }
@@ -1,5 +1,5 @@
 import { NextRequest, NextResponse } from "next/server";
-import { pinnedApi } from "@/lib/pinnedClient";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
 
 export async function GET(req: NextRequest) {
   const username = req.nextUrl.searchParams.get('username');
@@ -8,7 +8,7 @@ export async function GET(req: NextRequest) {
   }
   
   try {
-    const flaskRes = await pinnedApi.get(`/api/getchats?username=${encodeURIComponent(username)}`);
+    const flaskRes = await pinnedApi.get(`/api/getchats?username=${encodeURIComponent(username)}`, { headers: sessionHeaders(req) });
     console.log(flaskRes.data)
     return NextResponse.json(flaskRes.data, { status: flaskRes.status });
   } catch (err: any) {
@@ -1,22 +1,40 @@
 import { NextRequest, NextResponse } from "next/server";
-import { pinnedApi } from "@/lib/pinnedClient";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
 
 export async function GET(req: NextRequest) {
   const username = req.nextUrl.searchParams.get('username');
   if (!username) {
     return NextResponse.json({ error: "Missing username parameter" }, { status: 400 });
   }
-  
+
+  const params: Record<string, string> = {};
+  for (const key of ['before', 'limit']) {
+    const value = req.nextUrl.searchParams.get(key);
+    if (value) params[key] = value;
+  }
+  const headers = sessionHeaders(req);
+  const ifNoneMatch = req.headers.get('if-none-match');
+  if (ifNoneMatch) headers['If-None-Match'] = ifNoneMatch;
+
   try {
-    const flaskRes = await pinnedApi.get(`/api/getdashboard?username=${encodeURIComponent(username)}`);
-    console.log(flaskRes.data)
-    return NextResponse.json(flaskRes.data, { status: flaskRes.status });
+    const flaskRes = await pinnedApi.get('/api/getdashboard', {
+      params,
+      headers,
+      validateStatus: status => status === 200 || status === 304,
+    });
+    const res = flaskRes.status === 304
+      ? new NextResponse(null, { status: 304 })
+      : NextResponse.json(flaskRes.data, { status: flaskRes.status });
+    for (const header of ['etag', 'cache-control', 'x-next-before']) {
+      const value = flaskRes.headers[header];
+      if (value) res.headers.set(header, String(value));
+    }
+    return res;
   } catch (err: any) {
-    console.log("here")
-    console.error('Error fetching chats:', err);
-    const errorMessage = err.response?.data?.error || err.message || "Failed to fetch chats";
+    console.error('Error fetching dashboard:', err);
+    const errorMessage = err.response?.data?.error || err.message || "Failed to fetch dashboard";
     return NextResponse.json({ error: errorMessage }, {
       status: err.response?.status || 500
     });
   }
-}
\ No newline at end of file
+}
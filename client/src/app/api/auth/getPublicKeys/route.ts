@@ -0,0 +1,36 @@
+import { NextRequest, NextResponse } from "next/server";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
+
+export async function GET(req: NextRequest) {
+  const usernames = req.nextUrl.searchParams.getAll('username');
+  if (!usernames.length) {
+    return NextResponse.json({ error: "Missing username parameter" }, { status: 400 });
+  }
+
+  const params = new URLSearchParams();
+  usernames.forEach(u => params.append('username', u));
+  const headers = sessionHeaders(req);
+  const ifNoneMatch = req.headers.get('if-none-match');
+  if (ifNoneMatch) headers['If-None-Match'] = ifNoneMatch;
+
+  try {
+    const flaskRes = await pinnedApi.get(`/api/getPublicKeys?${params}`, {
+      headers,
+      validateStatus: status => status === 200 || status === 304,
+    });
+    const res = flaskRes.status === 304
+      ? new NextResponse(null, { status: 304 })
+      : NextResponse.json(flaskRes.data, { status: flaskRes.status });
+    for (const header of ['etag', 'cache-control']) {
+      const value = flaskRes.headers[header];
+      if (value) res.headers.set(header, String(value));
+    }
+    return res;
+  } catch (err: any) {
+    console.error('Error fetching public keys:', err);
+    const errorMessage = err.response?.data?.error || err.message || "Failed to fetch public keys";
+    return NextResponse.json({ error: errorMessage }, {
+      status: err.response?.status || 500
+    });
+  }
+}
@@ -1,11 +1,16 @@
 import { NextRequest, NextResponse } from "next/server";
-import { pinnedApi } from "@/lib/pinnedClient";
+import { pinnedApi, setSessionCookie } from "@/lib/pinnedClient";
 
 export async function POST(req: NextRequest) {
   const body = await req.json();
   try {
     const flaskRes = await pinnedApi.post("/api/login", body);
-    return NextResponse.json(flaskRes.data, { status: flaskRes.status });
+    const { token, ...data } = flaskRes.data;
+    const res = NextResponse.json(data, { status: flaskRes.status });
+    if (token) {
+      setSessionCookie(res, token);
+    }
+    return res;
   } catch (err: any) {
     return NextResponse.json({ error: err.message }, {
       status: err.response?.status || 500
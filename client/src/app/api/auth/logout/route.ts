@@ -0,0 +1,16 @@
+import { NextRequest, NextResponse } from "next/server";
+import { pinnedApi, sessionHeaders, SESSION_COOKIE } from "@/lib/pinnedClient";
+
+export async function POST(req: NextRequest) {
+  let res: NextResponse;
+  try {
+    const flaskRes = await pinnedApi.post("/api/logout", {}, { headers: sessionHeaders(req) });
+    res = NextResponse.json(flaskRes.data, { status: flaskRes.status });
+  } catch (err: any) {
+    res = NextResponse.json({ error: err.message }, {
+      status: err.response?.status || 500
+    });
+  }
+  res.cookies.delete(SESSION_COOKIE);
+  return res;
+}
@@ -0,0 +1,14 @@
+import { NextRequest, NextResponse } from "next/server";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
+
+export async function POST(req: NextRequest) {
+  const body = await req.json();
+  try {
+    const flaskRes = await pinnedApi.post("/api/markread", body, { headers: sessionHeaders(req) });
+    return NextResponse.json(flaskRes.data, { status: flaskRes.status });
+  } catch (err: any) {
+    return NextResponse.json({ error: err.message }, {
+      status: err.response?.status || 500
+    });
+  }
+}
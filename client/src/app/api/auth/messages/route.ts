@@ -0,0 +1,27 @@
+import { NextRequest, NextResponse } from "next/server";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
+
+export async function GET(req: NextRequest) {
+  const username = req.nextUrl.searchParams.get('username');
+  const chatId = req.nextUrl.searchParams.get('chatId');
+  if (!username || !chatId) {
+    return NextResponse.json({ error: "Missing username or chatId parameter" }, { status: 400 });
+  }
+
+  const params = new URLSearchParams({ username, chatId });
+  for (const key of ['before', 'after', 'limit']) {
+    const value = req.nextUrl.searchParams.get(key);
+    if (value) params.set(key, value);
+  }
+
+  try {
+    const flaskRes = await pinnedApi.get(`/api/getmessages?${params.toString()}`, { headers: sessionHeaders(req) });
+    return NextResponse.json(flaskRes.data, { status: flaskRes.status });
+  } catch (err: any) {
+    console.error('Error fetching messages:', err);
+    const errorMessage = err.response?.data?.error || err.message || "Failed to fetch messages";
+    return NextResponse.json({ error: errorMessage }, {
+      status: err.response?.status || 500
+    });
+  }
+}
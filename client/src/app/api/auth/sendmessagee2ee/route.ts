@@ -1,10 +1,10 @@
 import { NextRequest, NextResponse } from "next/server";
-import { pinnedApi } from "@/lib/pinnedClient";
+import { pinnedApi, sessionHeaders } from "@/lib/pinnedClient";
 
 export async function POST(req: NextRequest) {
   const body = await req.json();
   try {
-    const flaskRes = await pinnedApi.post("/api/sendmessagee2ee", body);
+    const flaskRes = await pinnedApi.post("/api/sendmessagee2ee", body, { headers: sessionHeaders(req) });
     return NextResponse.json(flaskRes.data, { status: flaskRes.status });
   } catch (err: any) {
     return NextResponse.json({ error: err.message }, {
@@ -2,14 +2,17 @@
 import { useEffect, useState, useRef } from "react";
 import { useRouter } from "next/navigation";
 import { loadIdentity } from '@/lib/identity';
+import { fetchPublicKeys, getPublicKey } from '@/lib/publicKeys';
 import { io } from 'socket.io-client';
 import { deriveSharedSecret, deriveKeys, encryptThenMac, decryptThenVerify } from '@/lib/crypto';
 
 interface ChatSummary {
   id: number | string;
   name: string;
+  unread: number;
 }
 interface Message {
+  id?: number;
   sender: string;
   content: string;
   timestamp: string;
@@ -20,6 +23,10 @@ interface ChatData {
   type: 'group' | 'private';
   participants: string[];
   messages: Message[];
+  unread?: number;
+  loaded?: boolean;
+  hasMore?: boolean;
+  before?: number;
 }
 
 export default function Chat() {
@@ -39,6 +46,9 @@ export default function Chat() {
   const [keyEnc, setKeyEnc] = useState<CryptoKey|null>(null);
   const [keyMac, setKeyMac] = useState<CryptoKey|null>(null);
   const messagesContainerRef = useRef<HTMLDivElement>(null);
+  const chatDataRef = useRef<Record<string|number, any>>({});
+  const activeChatRef = useRef(activeChat);
+  const hasConnectedRef = useRef(false);
   
   useEffect(() => {
     const username = localStorage.getItem('username');
@@ -60,11 +70,42 @@ export default function Chat() {
     };
   }, []);
 
+  // Unread badges live in the sidebar lists; the server keeps the real count
+  function setUnread(chatId: number | string, update: (unread: number) => number) {
+    const apply = (chats: ChatSummary[]) =>
+      chats.map(chat => chat.id == chatId ? { ...chat, unread: update(chat.unread) } : chat)
+    setGroupChats(apply)
+    setIndividualChats(apply)
+  }
+
+  async function markRead(chatId: number | string, messageId?: number) {
+    setUnread(chatId, () => 0)
+    try {
+      const res = await fetch('/api/auth/markread', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ chatId, messageId })
+      })
+      if (res.ok) {
+        const data = await res.json()
+        setUnread(chatId, () => data.unread)
+      }
+    } catch (error) {
+      console.error('Error marking chat as read:', error);
+    }
+  }
+
   useEffect(() => {
     if (!socket) return;
     
     const handleNewMessage = async (msg: any) => {
       console.log("New message received:", msg);
+
+      if (msg.chat_id == activeChatRef.current.id) {
+        markRead(msg.chat_id, msg.id);
+      } else if (msg.sender !== localStorage.getItem('username')) {
+        setUnread(msg.chat_id, unread => unread + 1);
+      }
       
       // Always update the message in the relevant chat data regardless of active chat
       setChatData(prevChatData => {
@@ -78,6 +119,7 @@ export default function Chat() {
           thisChat.messages = [
             ...thisChat.messages,
             {
+              id: msg.id,
               sender: msg.sender,
               iv: msg.iv,
               ct: msg.ct, 
@@ -89,6 +131,7 @@ export default function Chat() {
           thisChat.messages = [
             ...thisChat.messages,
             {
+              id: msg.id,
               sender: msg.sender,
               content: msg.content,
               timestamp: msg.timestamp
@@ -109,9 +152,7 @@ export default function Chat() {
           
           const otherUsername = updatedChat.participants.find((p: string) => p !== username);
           if (otherUsername) {
-            const pkRes = await fetch(`/api/auth/getPublicKey?username=${encodeURIComponent(otherUsername)}`);
-            const pkJson = await pkRes.json();
-            const theirPubB64 = pkJson.publicKey;
+            const theirPubB64 = await getPublicKey(otherUsername);
             
             const shared = await deriveSharedSecret(privKey, theirPubB64);
             const { keyEnc, keyMac } = await deriveKeys(shared);
@@ -133,6 +174,7 @@ export default function Chat() {
                     messages[lastIdx].sender === msg.sender && 
                     messages[lastIdx].iv === msg.iv) {
                   messages[lastIdx] = {
+                    id: msg.id,
                     sender: msg.sender,
                     content: content,
                     timestamp: msg.timestamp
@@ -159,10 +201,16 @@ export default function Chat() {
   }, [socket, chatData]);
 
   useEffect(() => {
+    activeChatRef.current = activeChat;
     if (!socket || !activeChat) return;
     socket.emit('join', { chat_id: activeChat.id });
   }, [socket, activeChat])
 
+  useEffect(() => {
+    if (!activeChat.id) return;
+    markRead(activeChat.id);
+  }, [activeChat.id])
+
   useEffect(() => {
     const username = localStorage.getItem('username') || '';
     async function fetchChats(){
@@ -179,41 +227,8 @@ export default function Chat() {
         const groups: ChatSummary[] = []
         const privates: ChatSummary[] = []
         const map: Record<number | string, ChatData> = {}
-        const { privKey } = await loadIdentity(username)
 
         for (const chat of data) {
-          let msgs: Message[] = []
-
-          if (chat.type === 'private') {
-            const other = chat.participants.find((p) => p !== username)!
-            const pkRes = await fetch(`/api/auth/getPublicKey?username=${encodeURIComponent(other)}`)
-            const pkJson = await pkRes.json();
-            console.log(pkJson);
-            const theirPubB64 = pkJson.publicKey;
-            const shared = await deriveSharedSecret(privKey, theirPubB64)
-            const { keyEnc, keyMac } = await deriveKeys(shared)
-
-            msgs = await Promise.all(
-              chat.messages.map(async (m:any) => {
-                const content = await decryptThenVerify(
-                  keyEnc, keyMac,
-                  m.iv, m.ct, m.tag
-                )
-                return {
-                  sender:    m.sender,
-                  content,
-                  timestamp: m.timestamp
-                }
-              })
-            )
-          } else {
-            msgs = chat.messages.map((m:any) => ({
-              sender:    m.sender,
-              content:   m.content,
-              timestamp: m.timestamp
-            }))
-          }
-
           const displayName = chat.type === 'private'
           ? chat.participants.find((p:string) => p !== username)!
           : chat.name
@@ -223,12 +238,13 @@ export default function Chat() {
             name:     displayName,
             type:     chat.type,
             participants: chat.participants,
-            messages:     msgs
+            messages:     [],
+            loaded:       false
           }
           if (chat.type === 'group') {
-            groups.push({ id: chat.chat_id, name: displayName })
+            groups.push({ id: chat.chat_id, name: displayName, unread: chat.unread ?? 0 })
           } else {
-            privates.push({ id: chat.chat_id, name: displayName })
+            privates.push({ id: chat.chat_id, name: displayName, unread: chat.unread ?? 0 })
           }
         }
         console.log(map)
@@ -238,6 +254,10 @@ export default function Chat() {
         setIndividualChats(privates)
         setChatData(map)
 
+        // One request for every private-chat peer instead of one per chat opened
+        fetchPublicKeys(privates.map(chat => chat.name)).catch(error =>
+          console.error('Error prefetching public keys:', error))
+
         if (groups.length) {
           setActiveChat({ id: groups[0].id, type: 'group', name: groups[0].name })
         } else if (privates.length) {
@@ -254,6 +274,144 @@ export default function Chat() {
     fetchChats();
   }, []);
 
+  // Decrypt E2EE rows (or copy plain ones) into the shape the message list renders
+  async function toDisplayMessages(chat: ChatData, raw: any[]): Promise<Message[]> {
+    if (chat.type !== 'private') {
+      return raw.map((m: any) => ({
+        id:        m.id,
+        sender:    m.sender,
+        content:   m.content,
+        timestamp: m.timestamp
+      }))
+    }
+    const username = localStorage.getItem('username') || '';
+    const other = chat.participants.find((p: string) => p !== username)!
+    const { privKey } = await loadIdentity(username)
+    const shared = await deriveSharedSecret(privKey, await getPublicKey(other))
+    const { keyEnc, keyMac } = await deriveKeys(shared)
+
+    return Promise.all(
+      raw.map(async (m: any) => ({
+        id:        m.id,
+        sender:    m.sender,
+        content:   await decryptThenVerify(keyEnc, keyMac, m.iv, m.ct, m.tag),
+        timestamp: m.timestamp
+      }))
+    )
+  }
+
+  // After a socket reconnect, fetch only what loaded chats missed while offline
+  async function syncMissedMessages() {
+    const chats = chatDataRef.current;
+    const marks: Record<string, number> = {};
+    for (const [chatId, chat] of Object.entries(chats)) {
+      if (!chat.loaded) continue;
+      const withId = chat.messages.filter((m: Message) => m.id);
+      marks[chatId] = withId.length ? withId[withId.length - 1].id! : 0;
+    }
+    if (!Object.keys(marks).length) return;
+
+    try {
+      const response = await fetch('/api/auth/sync', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ chats: marks })
+      });
+      const delta = await response.json();
+      if (!response.ok) {
+        throw new Error(delta.error || 'Failed to sync messages');
+      }
+
+      for (const chatId of Object.keys(marks)) {
+        const chat = chats[chatId];
+        const raw = (chat.type === 'private' ? delta.e2ee : delta.plain)
+          .filter((m: any) => String(m.chat_id) === chatId);
+        if (!raw.length) continue;
+        const msgs = await toDisplayMessages(chat, raw);
+        setChatData(prevChatData => ({
+          ...prevChatData,
+          [chatId]: {
+            ...prevChatData[chatId],
+            messages: [...prevChatData[chatId].messages, ...msgs]
+          }
+        }));
+      }
+    } catch (error) {
+      console.error('Error syncing messages:', error);
+    }
+  }
+
+  useEffect(() => {
+    chatDataRef.current = chatData;
+  }, [chatData]);
+
+  useEffect(() => {
+    if (!socket) return;
+
+    const handleConnect = () => {
+      if (hasConnectedRef.current) {
+        if (activeChatRef.current.id) {
+          socket.emit('join', { chat_id: activeChatRef.current.id });
+        }
+        syncMissedMessages();
+      }
+      hasConnectedRef.current = true;
+    };
+
+    socket.on('connect', handleConnect);
+    return () => {
+      socket.off('connect', handleConnect);
+    };
+  }, [socket]);
+
+  async function loadMessages(chatId: number | string, before?: number) {
+    const chat = chatData[chatId];
+    if (!chat) return;
+    const username = localStorage.getItem('username') || '';
+
+    const params = new URLSearchParams({ username, chatId: String(chatId) });
+    if (before) params.set('before', String(before));
+
+    try {
+      const response = await fetch(`/api/auth/messages?${params.toString()}`);
+      const page = await response.json();
+      if (!response.ok) {
+        throw new Error(page.error || 'Failed to fetch messages');
+      }
+
+      const msgs = await toDisplayMessages(chat, page.messages);
+
+      setChatData(prevChatData => {
+        const thisChat = prevChatData[chatId];
+        if (!thisChat) return prevChatData;
+        return {
+          ...prevChatData,
+          [chatId]: {
+            ...thisChat,
+            messages: [...msgs, ...thisChat.messages],
+            loaded:   true,
+            hasMore:  page.has_more,
+            before:   page.before
+          }
+        };
+      });
+    } catch (error) {
+      console.error('Error fetching messages:', error);
+    }
+  }
+
+  useEffect(() => {
+    if (!activeChat.id) return;
+    const chat = chatData[activeChat.id];
+    if (chat && !chat.loaded) {
+      setChatData(prevChatData => ({
+        ...prevChatData,
+        [activeChat.id]: { ...prevChatData[activeChat.id], loaded: true }
+      }));
+      loadMessages(activeChat.id);
+    }
+  }, [activeChat, chatData])
+
   useEffect(() => {
     if (!activeChat || activeChat.type !== 'private') return
 
@@ -263,9 +421,7 @@ export default function Chat() {
       if (!otherUsername) return;
 
       const { privKey } = await loadIdentity(myUsername)
-      const res = await fetch(`/api/auth/getPublicKey?username=${encodeURIComponent(otherUsername)}`)
-      const pkJson = await res.json();
-      const theirPubB64 = pkJson.publicKey;
+      const theirPubB64 = await getPublicKey(otherUsername);
 
       const shared = await deriveSharedSecret(privKey, theirPubB64)
       const { keyEnc, keyMac } = await deriveKeys(shared)
@@ -356,7 +512,14 @@ export default function Chat() {
                   }`}
                   onClick={() => setActiveChat({ id: chat.id, type: "group", name: chat.name })}
                 >
-                  {chat.name}
+                  <span className="flex items-center justify-between">
+                    {chat.name}
+                    {chat.unread > 0 && (
+                      <span className="ml-2 rounded-full bg-indigo-500 px-2 text-xs text-white">
+                        {chat.unread}
+                      </span>
+                    )}
+                  </span>
                 </li>
               ))}
             </ul>
@@ -375,7 +538,14 @@ export default function Chat() {
                   }`}
                   onClick={() => setActiveChat({ id: chat.id, type: "private", name: chat.name })}
                 >
-                  {chat.name}
+                  <span className="flex items-center justify-between">
+                    {chat.name}
+                    {chat.unread > 0 && (
+                      <span className="ml-2 rounded-full bg-indigo-500 px-2 text-xs text-white">
+                        {chat.unread}
+                      </span>
+                    )}
+                  </span>
                 </li>
               ))}
             </ul>
@@ -414,6 +584,16 @@ export default function Chat() {
             ref={messagesContainerRef}
             className="flex-1 overflow-y-auto p-4 space-y-3 min-h-0 max-h-[calc(100vh-220px)]"
           >
+            {chatData[activeChat.id]?.hasMore && (
+              <div className="flex justify-center">
+                <button
+                  onClick={() => loadMessages(activeChat.id, chatData[activeChat.id].before)}
+                  className="text-xs text-indigo-700 px-3 py-1 border border-indigo-300 hover:bg-indigo-50"
+                >
+                  Load older messages
+                </button>
+              </div>
+            )}
             {(chatData[activeChat.id]?.messages || []).map((message: Message, index: number) => {
               const myUsername = typeof window !== "undefined" ? localStorage.getItem('username') : '';
               const isMine = message.sender === myUsername;
@@ -1,6 +1,7 @@
 'use client'
 import { useEffect, useState } from "react";
 import { useRouter } from "next/navigation";
+import { io } from 'socket.io-client';
 
 interface Task {
   id:             number;
@@ -37,6 +38,38 @@ export default function Task() {
     fetchTasks();
   }, []);
 
+  // Task changes arrive on each group's chat room instead of by polling gettasks
+  const groupIds = [...new Set(tasks.map(task => task.groupId))].sort().join(',');
+  useEffect(() => {
+    if (!groupIds) return;
+    const socket = io('https://localhost:8000', {
+      path: '/socket.io',
+      transports: ['websocket'],
+      secure: true
+    });
+    socket.on('connect', () => {
+      for (const groupId of groupIds.split(',')) {
+        socket.emit('join', { chat_id: Number(groupId) });
+      }
+    });
+    socket.on('tasks_changed', (change: any) => {
+      setTasks(prev => {
+        if (change.ended) {
+          return prev.filter(t => t.groupId !== change.group_id);
+        }
+        const statuses = new Map((change.updated || []).map((u: any) => [u.id, u.status]));
+        const known = new Set(prev.map(t => t.id));
+        return [
+          ...prev.map(t => statuses.has(t.id) ? { ...t, status: statuses.get(t.id) as string } : t),
+          ...(change.added || []).filter((t: Task) => !known.has(t.id))
+        ];
+      });
+    });
+    return () => {
+      socket.disconnect();
+    };
+  }, [groupIds]);
+
   const myTasks = tasks.filter(task => task.participantName === username);
   
   const handleToggleStatus = async (task: Task) => {
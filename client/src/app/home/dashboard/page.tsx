@@ -16,6 +16,8 @@ export default function Dashboard() {
     const [dashboard, setDashboard] = useState<DashboardItem[]>([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState<string | null>(null);
+    const [nextBefore, setNextBefore] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     useEffect(() => {
         const username = localStorage.getItem('username');
@@ -33,6 +35,7 @@ export default function Dashboard() {
             const response = await fetch(`/api/auth/dashboard?username=${encodeURIComponent(username)}`)
             const data = (await response.json()) as DashboardItem[];
             setDashboard(data);
+            setNextBefore(response.headers.get('x-next-before'));
             setError(null);
           } catch (error) {
             console.error('Error fetching dashboard:', error);
@@ -47,6 +50,22 @@ export default function Dashboard() {
         
     }, []);
     
+    // Posts arrive newest first; older pages are fetched on demand
+    const loadMore = async () => {
+      if (!nextBefore || !username) return;
+      setLoadingMore(true);
+      try {
+        const response = await fetch(`/api/auth/dashboard?username=${encodeURIComponent(username)}&before=${nextBefore}`);
+        const data = (await response.json()) as DashboardItem[];
+        setDashboard(prev => [...prev, ...data]);
+        setNextBefore(response.headers.get('x-next-before'));
+      } catch (error) {
+        console.error('Error fetching dashboard:', error);
+      } finally {
+        setLoadingMore(false);
+      }
+    };
+
     const handleViewDashboard = (item: DashboardItem) => {
       const queryParams = new URLSearchParams({
         title: item.title,
@@ -84,7 +103,7 @@ export default function Dashboard() {
             </div>
           ) : (
             <div className="flex flex-col space-y-4">
-              {[...dashboard].reverse().map((item) => (
+              {dashboard.map((item) => (
                 <div 
                   key={item.id}
                   onClick={() => handleViewDashboard(item)}
@@ -103,6 +122,15 @@ export default function Dashboard() {
                   </div>
                 </div>
               ))}
+              {nextBefore && (
+                <button
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="text-sm border border-gray-300 px-3 py-1 rounded-sm hover:bg-gray-100 self-center"
+                >
+                  {loadingMore ? 'Loading...' : 'Load more'}
+                </button>
+              )}
             </div>
           )}
         </div>
@@ -77,7 +77,8 @@ export default function Home() {
     }
   }
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    await fetch('/api/auth/logout', { method: 'POST' });
     localStorage.removeItem('username');
     router.push('/');
   };
@@ -94,7 +94,9 @@ export default function Timetable() {
         setShowAddForm(false);
         fetchTimetable();
       } else {
-        setError('Failed to add class');
+        // 409 names the slot it overlaps
+        const data = await response.json().catch(() => ({}));
+        setError(data.error || 'Failed to add class');
       }
     } catch (error) {
       console.error('Error adding class:', error);
@@ -4,6 +4,7 @@ import axios from "axios";
 import fs   from "fs";
 import { createHash } from "crypto";
 import path from "path";
+import type { NextRequest, NextResponse } from "next/server";
 
 const DEV_MODE = false;
 const KNOWN_FINGERPRINTS = "w9N51ntJHhB3IOd+UwI6mb1cXklPncFPAX1U+C2GCHQ=";
@@ -69,4 +70,21 @@ pinnedApi.interceptors.response.use(
       
       return Promise.reject(new Error(errorMessage));
     }
-  );
\ No newline at end of file
+  );
+export const SESSION_COOKIE = "session";
+
+// Forward the browser's session cookie to Flask as a bearer token
+export function sessionHeaders(req: NextRequest): Record<string, string> {
+  const token = req.cookies.get(SESSION_COOKIE)?.value;
+  return token ? { Authorization: `Bearer ${token}` } : {};
+}
+
+export function setSessionCookie(res: NextResponse, token: string) {
+  res.cookies.set(SESSION_COOKIE, token, {
+    httpOnly: true,
+    secure: true,
+    sameSite: "strict",
+    path: "/",
+    maxAge: 7 * 24 * 60 * 60,
+  });
+}
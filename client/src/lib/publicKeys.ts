@@ -0,0 +1,41 @@
+// Peer public keys never change after signup, so each one is fetched at most
+// once per page load; the browser revalidates the batch responses by ETag.
+const MAX_PER_REQUEST = 200;
+
+const keys = new Map<string, string>();
+const pending = new Map<string, Promise<void>>();
+
+function requestKeys(usernames: string[]) {
+  const params = new URLSearchParams();
+  usernames.forEach(u => params.append('username', u));
+  const request = fetch(`/api/auth/getPublicKeys?${params}`)
+    .then(async res => {
+      const data = await res.json();
+      if (!res.ok) throw new Error(data.error || 'Failed to fetch public keys');
+      for (const [username, publicKey] of Object.entries(data.keys)) {
+        keys.set(username, publicKey as string);
+      }
+    })
+    .finally(() => usernames.forEach(u => pending.delete(u)));
+  usernames.forEach(u => pending.set(u, request));
+}
+
+export async function fetchPublicKeys(usernames: string[]) {
+  const wanted = [...new Set(usernames)].filter(u => !keys.has(u) && !pending.has(u));
+  for (let i = 0; i < wanted.length; i += MAX_PER_REQUEST) {
+    requestKeys(wanted.slice(i, i + MAX_PER_REQUEST));
+  }
+  await Promise.all(usernames.map(u => pending.get(u)));
+  const found: Record<string, string> = {};
+  for (const username of usernames) {
+    const publicKey = keys.get(username);
+    if (publicKey) found[username] = publicKey;
+  }
+  return found;
+}
+
+export async function getPublicKey(username: string) {
+  const found = await fetchPublicKeys([username]);
+  if (!found[username]) throw new Error(`No public key for ${username}`);
+  return found[username];
+}
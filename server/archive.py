@@ -0,0 +1,314 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from db import DB_PATH, PRAGMAS
+from logs import get_logger
+from offload import run_blocking
+
+log = get_logger('archive')
+
+# Messages older than CHAT_APP_ARCHIVE_AFTER_DAYS move out of chat_app.db
+# into one SQLite file per month under CHAT_APP_ARCHIVE_DIR. Message ids
+# grow with time, so each table's archive is a contiguous id prefix of its
+# history and each file covers a known id range, recorded in
+# archive_segments. History pages that run past the live rows continue
+# into the archive files, newest first. 0 days turns the archiver off.
+ARCHIVE_AFTER_DAYS = float(os.environ.get('CHAT_APP_ARCHIVE_AFTER_DAYS', '0'))
+ARCHIVE_DIR = os.environ.get(
+    'CHAT_APP_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'archive')
+)
+ARCHIVE_INTERVAL = float(os.environ.get('CHAT_APP_ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_BATCH = int(os.environ.get('CHAT_APP_ARCHIVE_BATCH', '5000'))
+ARCHIVE_VACUUM_PAGES = int(os.environ.get('CHAT_APP_ARCHIVE_VACUUM_PAGES', '2000'))
+
+# table -> the column holding the message body
+TABLES = {'plainmessages': 'content', 'e2eemessages': 'payload'}
+
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS plainmessages (
+        id        INTEGER PRIMARY KEY,
+        chat_id   INTEGER NOT NULL,
+        sender_id TEXT NOT NULL,
+        content   TEXT NOT NULL,
+        timestamp TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS e2eemessages (
+        id        INTEGER PRIMARY KEY,
+        chat_id   INTEGER NOT NULL,
+        sender_id TEXT NOT NULL,
+        payload   BLOB NOT NULL,
+        timestamp TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_plainmessages_chat_id ON plainmessages (chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_e2eemessages_chat_id ON e2eemessages (chat_id, id)",
+)
+
+
+def segment_path(period, directory=ARCHIVE_DIR):
+    return os.path.join(directory, f'messages-{period}.db')
+
+
+def _open_segment(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def archive_table(conn, table, cutoff, directory=ARCHIVE_DIR, batch=ARCHIVE_BATCH):
+    """ Move one batch of the table's messages older than cutoff; returns rows moved.
+
+    Rows are copied into their month's file and committed there before they
+    are deleted here, so a crash in between leaves duplicates that the next
+    run skips over, never a gap.
+    """
+    body = TABLES[table]
+    rows = conn.execute(f"""
+        SELECT id, chat_id, sender_id, {body}, timestamp, strftime('%Y-%m', timestamp)
+        FROM {table}
+        WHERE timestamp < ?
+        ORDER BY id
+        LIMIT ?
+    """, (cutoff, batch)).fetchall()
+    if not rows:
+        return 0
+
+    by_period = defaultdict(list)
+    for row in rows:
+        by_period[row[5] or 'undated'].append(row[:5])
+    os.makedirs(directory, exist_ok=True)
+    extents = {}
+    for period, period_rows in by_period.items():
+        segment = _open_segment(segment_path(period, directory))
+        try:
+            with segment:
+                segment.executemany(
+                    f"INSERT OR IGNORE INTO {table} (id, chat_id, sender_id, {body}, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    period_rows
+                )
+            # Read back from the file, so a batch copied twice (a crash, or
+            # two processes archiving at once) is never counted twice
+            extents[period] = segment.execute(f"SELECT MIN(id), MAX(id), COUNT(*) FROM {table}").fetchone()
+        finally:
+            segment.close()
+
+    with conn:
+        for period, (min_id, max_id, count) in extents.items():
+            conn.execute("""
+                INSERT INTO archive_segments (table_name, period, path, min_id, max_id, rows)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (table_name, period) DO UPDATE SET
+                    min_id = excluded.min_id,
+                    max_id = excluded.max_id,
+                    rows = excluded.rows
+            """, (table, period, segment_path(period, directory), min_id, max_id, count))
+        conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(row[0],) for row in rows])
+    return len(rows)
+
+
+def archive_once(path=DB_PATH, days=ARCHIVE_AFTER_DAYS, directory=ARCHIVE_DIR, batch=ARCHIVE_BATCH):
+    """ Archive everything older than ``days`` in batches, then give freed pages back """
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+    conn = sqlite3.connect(path, timeout=30)
+    moved = {}
+    try:
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        for table in TABLES:
+            total = 0
+            while True:
+                count = archive_table(conn, table, cutoff, directory, batch)
+                total += count
+                if count < batch:
+                    break
+            moved[table] = total
+        if any(moved.values()):
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                conn.execute(f"PRAGMA incremental_vacuum({ARCHIVE_VACUUM_PAGES})")
+            else:
+                log.warning("auto_vacuum is not INCREMENTAL; run archive.py --enable-incremental-vacuum once")
+    finally:
+        conn.close()
+    return moved
+
+
+def _read_segment(path, table, chat_id, before, after, limit):
+    body = TABLES[table]
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        if after is not None:
+            return conn.execute(f"""
+                SELECT id, sender_id, {body}, timestamp FROM {table}
+                WHERE chat_id = ? AND id > ? ORDER BY id ASC LIMIT ?
+            """, (chat_id, after, limit)).fetchall()
+        rows = conn.execute(f"""
+            SELECT id, sender_id, {body}, timestamp FROM {table}
+            WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+        """, (chat_id, before, limit)).fetchall()
+        rows.reverse()
+        return rows
+    except sqlite3.OperationalError:
+        log.exception("Could not read archive segment", extra={"path": path})
+        return []
+    finally:
+        conn.close()
+
+
+def has_segments(c, table):
+    c.execute("SELECT 1 FROM archive_segments WHERE table_name = ? LIMIT 1", (table,))
+    return c.fetchone() is not None
+
+
+def load_archived_rows(c, table, chat_id, before=None, after=None, limit=50):
+    """ (rows, has_more) from the archive files, oldest first, like load_message_rows """
+    if after is not None:
+        c.execute("""
+            SELECT path FROM archive_segments
+            WHERE table_name = ? AND max_id > ? ORDER BY min_id ASC
+        """, (table, after))
+    else:
+        c.execute("""
+            SELECT path FROM archive_segments
+            WHERE table_name = ? AND min_id < ? ORDER BY max_id DESC
+        """, (table, before if before is not None else 2 ** 63 - 1))
+    paths = [row[0] for row in c.fetchall()]
+
+    rows = []
+    for path in paths:
+        want = limit + 1 - len(rows)
+        if want <= 0:
+            break
+        if after is not None:
+            found = run_blocking(_read_segment, path, table, chat_id, None, rows[-1][0] if rows else after, want)
+            rows.extend(found)
+        else:
+            bound = rows[0][0] if rows else (before if before is not None else 2 ** 63 - 1)
+            found = run_blocking(_read_segment, path, table, chat_id, bound, None, want)
+            rows[:0] = found
+    has_more = len(rows) > limit
+    if after is not None:
+        return rows[:limit], has_more
+    return rows[-limit:] if has_more else rows, has_more
+
+
+def merge_archived(c, table, chat_id, before, after, limit, rows, has_more):
+    """ Extend a live page with archived rows when it runs past the live window """
+    if not has_segments(c, table):
+        return rows, has_more
+    if after is not None:
+        archived, more = load_archived_rows(c, table, chat_id, after=after, limit=limit)
+        if not archived:
+            return rows, has_more
+        combined = archived + [row for row in rows if row[0] > archived[-1][0]]
+        return combined[:limit], more or has_more or len(combined) > limit
+    if has_more:
+        return rows, has_more
+    if len(rows) >= limit:
+        # A full live page says nothing about what was archived below it
+        older, _ = load_archived_rows(c, table, chat_id, before=rows[0][0], limit=1)
+        return rows, bool(older)
+    bound = rows[0][0] if rows else before
+    archived, more = load_archived_rows(c, table, chat_id, before=bound, limit=limit - len(rows))
+    return archived + rows, more
+
+
+class Archiver:
+    """ Background thread that runs archive_once every ARCHIVE_INTERVAL seconds.
+
+    Every worker starts one, but only the process holding the lock file in
+    ARCHIVE_DIR archives; the others retry the lock each interval and take
+    over if that process exits.
+    """
+
+    def __init__(self, path=DB_PATH, days=ARCHIVE_AFTER_DAYS, interval=ARCHIVE_INTERVAL, directory=ARCHIVE_DIR):
+        self.path = path
+        self.days = days
+        self.interval = interval
+        self.directory = directory
+        self._thread = None
+        self._lock_file = None
+        self.runs = 0
+        self.archived = 0
+        self.failures = 0
+
+    def start(self):
+        if self.days <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="archiver", daemon=True)
+        self._thread.start()
+
+    def _claim(self):
+        """ True once this process holds the archiver lock, which it keeps """
+        if fcntl is None or self._lock_file is not None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, '.archiver.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if not self._claim():
+                    time.sleep(self.interval)
+                    continue
+                moved = run_blocking(archive_once, self.path, self.days, self.directory)
+                self.archived += sum(moved.values())
+                if any(moved.values()):
+                    log.info("Archived messages", extra=moved)
+            except (sqlite3.Error, OSError):
+                self.failures += 1
+                log.exception("Archive run failed")
+            self.runs += 1
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "active": int(fcntl is None or self._lock_file is not None),
+            "runs": self.runs,
+            "archived": self.archived,
+            "failures": self.failures,
+        }
+
+
+archiver = Archiver()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old chat messages into monthly archive files")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--days', type=float, default=ARCHIVE_AFTER_DAYS or 180,
+                        help="archive messages older than this many days")
+    parser.add_argument('--dir', default=ARCHIVE_DIR)
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="switch the database to auto_vacuum=INCREMENTAL (runs a full VACUUM once)")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        conn = sqlite3.connect(args.db, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.close()
+    print(archive_once(args.db, args.days, args.dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+""" Seeded, in-process load test for the chat API and Socket.IO fan-out.
+
+    python benchmark.py                                  default scale, JSON report on stdout
+    python benchmark.py --users 2000 --messages 200000 --concurrency 32 --out after.json
+    python benchmark.py --compare before.json after.json
+
+Each run seeds a throwaway SQLite database from --seed, then drives the
+routes through Flask's and Flask-SocketIO's test clients from a pool of
+threads, so no network or TLS is involved and two runs with the same
+arguments on the same machine are comparable. --compare prints the change
+in p50/p99/throughput per scenario and exits 1 when any scenario regressed
+by more than --max-regression.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+PASSWORD = 'benchmark-password'
+SALT = 'benchmark-salt'
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday')
+TIME_SLOTS = ('09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00', '16:00', '17:00')
+STATUSES = ('In Progess', 'Done', 'Task is Ended!')
+WORDS = ('meeting', 'deadline', 'report', 'lunch', 'review', 'draft', 'slides', 'exam', 'notes', 'schedule',
+         'project', 'update', 'question', 'thanks', 'tomorrow', 'today', 'please', 'check', 'done', 'later')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Seed a database and load-test the chat server")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for data and request mix")
+    parser.add_argument('--db', default=None, help="database file (default: a temporary file)")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--groups', type=int, default=50, help="group chats")
+    parser.add_argument('--group-size', type=int, default=8, help="participants per group chat")
+    parser.add_argument('--private-chats', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20000, help="seeded plain messages")
+    parser.add_argument('--e2ee-messages', type=int, default=20000, help="seeded E2EE messages")
+    parser.add_argument('--tasks', type=int, default=10, help="tasks per group chat")
+    parser.add_argument('--timetable', type=int, default=5, help="timetable entries per user")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads per scenario")
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--login-requests', type=int, default=20,
+                        help="login requests (each one is a full Argon2 verify)")
+    parser.add_argument('--listeners', type=int, default=50, help="Socket.IO clients in the fan-out room")
+    parser.add_argument('--fanout-messages', type=int, default=200)
+    parser.add_argument('--out', default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help="compare two reports instead of running")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="allowed relative p99/throughput regression for --compare (default: 0.2)")
+    return parser.parse_args(argv)
+
+
+def seed_database(path, args, rng):
+    """ Fill an already-migrated database with synthetic data; returns row counts """
+    from e2ee_codec import pack
+    from hashing import ph
+
+    # One Argon2 hash shared by every user keeps seeding fast; logins still
+    # pay the full verify cost.
+    password_hash = ph.hash(PASSWORD + SALT)
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    usernames = [f'user{i:05d}' for i in range(args.users)]
+    c.executemany(
+        "INSERT INTO users (username, salt, password, public_key) VALUES (?, ?, ?, ?)",
+        [(name, SALT, password_hash, f'pk-{name}') for name in usernames]
+    )
+    user_ids = dict(c.execute("SELECT username, id FROM users").fetchall())
+
+    groups, privates = [], []
+    for i in range(args.groups):
+        c.execute("INSERT INTO chats (name, type) VALUES (?, 'group')", (f'group {i}',))
+        members = rng.sample(usernames, min(args.group_size, len(usernames)))
+        groups.append((c.lastrowid, members))
+    for _ in range(args.private_chats):
+        a, b = rng.sample(usernames, 2)
+        c.execute("INSERT INTO chats (name, type) VALUES (?, 'private')", (b,))
+        privates.append((c.lastrowid, [a, b]))
+    c.executemany(
+        "INSERT OR IGNORE INTO chat_participants (chat_id, user_id) VALUES (?, ?)",
+        [(chat_id, user_ids[name]) for chat_id, members in groups + privates for name in members]
+    )
+
+    if groups:
+        plain = []
+        for _ in range(args.messages):
+            chat_id, members = rng.choice(groups)
+            plain.append((chat_id, rng.choice(members), ' '.join(rng.choices(WORDS, k=rng.randint(3, 15)))))
+        c.executemany("INSERT INTO plainmessages (chat_id, sender_id, content) VALUES (?, ?, ?)", plain)
+    if privates:
+        e2ee = []
+        for _ in range(args.e2ee_messages):
+            chat_id, members = rng.choice(privates)
+            payload = pack(rng.randbytes(16), rng.randbytes(16 * rng.randint(1, 8)), rng.randbytes(32))
+            e2ee.append((chat_id, rng.choice(members), payload))
+        c.executemany("INSERT INTO e2eemessages (chat_id, sender_id, payload) VALUES (?, ?, ?)", e2ee)
+
+    c.executemany(
+        "INSERT OR IGNORE INTO tasks (group_id, participant_name, task_name, deadline, status) VALUES (?, ?, ?, ?, ?)",
+        [
+            (chat_id, rng.choice(members), f'task {n}', f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+             rng.choice(STATUSES))
+            for chat_id, members in groups for n in range(args.tasks)
+        ]
+    )
+    c.executemany(
+        "INSERT INTO timetable (username, day, time, duration, content) VALUES (?, ?, ?, ?, ?)",
+        [
+            (name, rng.choice(DAYS), rng.choice(TIME_SLOTS), rng.randint(1, 3), rng.choice(WORDS))
+            for name in usernames for _ in range(args.timetable)
+        ]
+    )
+    conn.commit()
+    counts = {
+        table: c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ('users', 'chats', 'chat_participants', 'plainmessages', 'e2eemessages', 'tasks', 'timetable')
+    }
+    conn.close()
+    return counts
+
+
+def load_users(path):
+    """ Return one dict per user with their group and private chat ids """
+    conn = sqlite3.connect(path)
+    users = {
+        user_id: {"id": user_id, "username": name, "groups": [], "privates": []}
+        for user_id, name in conn.execute("SELECT id, username FROM users")
+    }
+    for chat_id, user_id, chat_type in conn.execute("""
+        SELECT cp.chat_id, cp.user_id, c.type
+        FROM chat_participants cp JOIN chats c ON c.id = cp.chat_id
+    """):
+        users[user_id]["privates" if chat_type == 'private' else "groups"].append(chat_id)
+    conn.close()
+    return list(users.values())
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "status": {str(status): count for status, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(ordered, 0.50)),
+            "p90": ms(percentile(ordered, 0.90)),
+            "p99": ms(percentile(ordered, 0.99)),
+            "mean": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+            "max": ms(ordered[-1]) if ordered else 0.0,
+        },
+    }
+
+
+def run_scenario(app, count, concurrency, make_request, seed):
+    """ Issue count requests from concurrency threads; make_request(client, rng) returns a response """
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    per_worker = [count // concurrency + (1 if i < count % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index):
+        client = app.test_client()
+        rng = random.Random(seed * 1000 + index)
+        local_latencies, local_statuses = [], Counter()
+        for _ in range(per_worker[index]):
+            start = time.perf_counter()
+            response = make_request(client, rng)
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[response.status_code] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def b64(rng, size):
+    return base64.b64encode(rng.randbytes(size)).decode('ascii')
+
+
+def run_benchmarks(server, users, args):
+    from sessions import sessions
+
+    app = server.app
+    for user in users:
+        user["headers"] = {"Authorization": f"Bearer {sessions.create(user['id'], user['username'])}"}
+    with_groups = [u for u in users if u["groups"]] or users
+    with_privates = [u for u in users if u["privates"]] or users
+
+    def login(client, rng):
+        user = rng.choice(users)
+        return client.post('/api/login', json={"username": user["username"], "password": PASSWORD})
+
+    def getchats(client, rng):
+        return client.get('/api/getchats', headers=rng.choice(users)["headers"])
+
+    def sendmessageplain(client, rng):
+        user = rng.choice(with_groups)
+        return client.post('/api/sendmessageplain', headers=user["headers"], json={
+            "chatId": rng.choice(user["groups"]), "message": ' '.join(rng.choices(WORDS, k=8))
+        })
+
+    def sendmessagee2ee(client, rng):
+        user = rng.choice(with_privates)
+        return client.post('/api/sendmessagee2ee', headers=user["headers"], json={
+            "chatId": rng.choice(user["privates"]), "iv": b64(rng, 16), "ct": b64(rng, 64), "tag": b64(rng, 32)
+        })
+
+    def gettasks(client, rng):
+        return client.get('/api/gettasks', headers=rng.choice(with_groups)["headers"])
+
+    scenarios = {}
+    scenarios["login"] = run_scenario(app, args.login_requests, args.concurrency, login, args.seed)
+    for name, fn in (("getchats", getchats), ("sendmessageplain", sendmessageplain),
+                     ("sendmessagee2ee", sendmessagee2ee), ("gettasks", gettasks)):
+        scenarios[name] = run_scenario(app, args.requests, args.concurrency, fn, args.seed)
+    if with_groups[0]["groups"]:
+        scenarios["socketio_fanout"] = run_fanout(server, with_groups[0], args)
+    return scenarios
+
+
+def run_fanout(server, sender, args):
+    """ Post to one group chat watched by --listeners Socket.IO clients and check every delivery """
+    chat_id = sender["groups"][0]
+    listeners = [server.socketio.test_client(server.app) for _ in range(args.listeners)]
+    for listener in listeners:
+        listener.emit('join', {'chat_id': chat_id})
+        listener.get_received()
+
+    rng = random.Random(args.seed)
+
+    def post(client, _rng):
+        return client.post('/api/sendmessageplain', headers=sender["headers"], json={
+            "chatId": chat_id, "message": ' '.join(rng.choices(WORDS, k=8))
+        })
+
+    result = run_scenario(server.app, args.fanout_messages, args.concurrency, post, args.seed)
+    delivered = sum(
+        1 for listener in listeners for packet in listener.get_received() if packet["name"] == 'new_message'
+    )
+    for listener in listeners:
+        listener.disconnect()
+    result["listeners"] = args.listeners
+    result["deliveries"] = delivered
+    result["deliveries_expected"] = args.listeners * result["status"].get("200", 0)
+    result["deliveries_per_second"] = round(delivered / result["seconds"], 2) if result["seconds"] else 0.0
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    scratch = None if args.db else tempfile.mkdtemp(prefix='chat-bench-')
+    path = args.db or os.path.join(scratch, 'bench.db')
+    if os.path.exists(path):
+        raise SystemExit(f"{path} already exists; the benchmark needs a fresh database")
+    # The server reads its configuration at import time
+    os.environ['CHAT_APP_DB'] = path
+    os.environ.setdefault('CHAT_APP_LOG_LEVEL', 'ERROR')
+    os.environ['CHAT_APP_MESSAGE_QUEUE'] = ''
+    import server
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    counts = seed_database(path, args, rng)
+    seed_seconds = time.perf_counter() - start
+
+    scenarios = run_benchmarks(server, load_users(path), args)
+    if scratch is not None:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "async_mode": server.socketio.server.eio.async_mode,
+            "args": {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'db')},
+        },
+        "seed": {"rows": counts, "seconds": round(seed_seconds, 3)},
+        "scenarios": scenarios,
+    }
+
+
+def compare(baseline_path, candidate_path, max_regression):
+    """ Print per-scenario changes; returns True if nothing regressed past the limit """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    if baseline["meta"]["args"] != candidate["meta"]["args"]:
+        print("warning: reports were produced with different arguments", file=sys.stderr)
+
+    ok = True
+    print(f"{'scenario':<20}{'p50 ms':>18}{'p99 ms':>18}{'rps':>20}")
+    for name, before in baseline["scenarios"].items():
+        after = candidate["scenarios"].get(name)
+        if after is None:
+            continue
+        p50 = (before["latency_ms"]["p50"], after["latency_ms"]["p50"])
+        p99 = (before["latency_ms"]["p99"], after["latency_ms"]["p99"])
+        rps = (before["throughput_rps"], after["throughput_rps"])
+        regressed = (
+            (p99[0] and (p99[1] - p99[0]) / p99[0] > max_regression)
+            or (rps[0] and (rps[0] - rps[1]) / rps[0] > max_regression)
+        )
+        ok = ok and not regressed
+        print(f"{name:<20}{p50[0]:>8.2f} ->{p50[1]:>8.2f}{p99[0]:>8.2f} ->{p99[1]:>8.2f}"
+              f"{rps[0]:>9.1f} ->{rps[1]:>9.1f}{'  REGRESSED' if regressed else ''}")
+    return ok
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.max_regression) else 1)
+
+    report = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    # The write batcher and log listener threads are daemons; skip their teardown
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
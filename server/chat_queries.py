@@ -0,0 +1,273 @@
+import json
+from collections import defaultdict
+
+from e2ee_codec import unpack_b64
+
+
+def e2ee_fields(payload, binary=False):
+    """ The ciphertext fields of an E2EE message: raw payload bytes, or base64 iv/ct/tag """
+    if binary:
+        return {"payload": bytes(payload)}
+    return unpack_b64(payload)
+
+
+def load_participants(c, user_id):
+    """ Map chat_id -> participant usernames for all of the user's chats in one query """
+    c.execute("""
+        SELECT cp.chat_id, u.username
+        FROM chat_participants cp_filter
+        JOIN chat_participants cp ON cp.chat_id = cp_filter.chat_id
+        JOIN users u ON u.id = cp.user_id
+        WHERE cp_filter.user_id = ?
+    """, (user_id,))
+    participants = defaultdict(list)
+    for chat_id, username in c.fetchall():
+        participants[chat_id].append(username)
+    return participants
+
+
+def load_chat_type(c, chat_id, user_id):
+    """ Return the chat type if the user participates in the chat, else None """
+    c.execute("""
+        SELECT ch.type
+        FROM chats ch
+        JOIN chat_participants cp ON cp.chat_id = ch.id
+        WHERE ch.id = ? AND cp.user_id = ?
+    """, (chat_id, user_id))
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def load_message_rows(c, chat_id, chat_type, before=None, after=None, limit=50):
+    """ Keyset-paginate one chat's history on message id.
+
+    ``before`` returns the ``limit`` messages older than that id, ``after``
+    the ``limit`` messages newer than it, and neither the newest page.
+    Rows are (id, sender, content or payload, timestamp), oldest first;
+    format_messages turns them into the response shape.
+    """
+    if chat_type == 'private':
+        columns = "em.id, u.username, em.payload, em.timestamp"
+        source = "e2eemessages em JOIN users u ON em.sender_id = u.username"
+        alias = "em"
+    else:
+        columns = "pm.id, u.username, pm.content, pm.timestamp"
+        source = "plainmessages pm JOIN users u ON pm.sender_id = u.username"
+        alias = "pm"
+
+    params = [chat_id]
+    where = f"{alias}.chat_id = ?"
+    if after is not None:
+        where += f" AND {alias}.id > ?"
+        params.append(after)
+        order = "ASC"
+    else:
+        if before is not None:
+            where += f" AND {alias}.id < ?"
+            params.append(before)
+        order = "DESC"
+    params.append(limit + 1)
+
+    c.execute(f"""
+        SELECT {columns}
+        FROM {source}
+        WHERE {where}
+        ORDER BY {alias}.id {order}
+        LIMIT ?
+    """, params)
+    rows = c.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows.reverse()
+    return rows, has_more
+
+
+def format_messages(rows, chat_type, binary=False):
+    """ With ``binary`` E2EE messages carry their raw ``payload`` instead of base64 iv/ct/tag """
+    if chat_type == 'private':
+        return [
+            {
+                "id":        message_id,
+                "sender":    sender_name,
+                **e2ee_fields(payload, binary),
+                "timestamp": ts
+            }
+            for message_id, sender_name, payload, ts in rows
+        ]
+    return [
+        {
+            "id":        message_id,
+            "sender":    sender_name,
+            "content":   content,
+            "timestamp": ts
+        }
+        for message_id, sender_name, content, ts in rows
+    ]
+
+
+def load_chat_summaries(c, user_id, username):
+    """ Yield the getchats chat list from the user's chat_summaries rows as they are read """
+    participants = load_participants(c, user_id)
+    c.execute("""
+        SELECT s.chat_id, ch.name, ch.type, s.last_message_id, s.last_sender,
+               s.last_preview, s.last_payload, s.last_timestamp, s.unread_count
+        FROM chat_summaries s
+        JOIN chats ch ON ch.id = s.chat_id
+        WHERE s.user_id = ?
+        ORDER BY ch.created_at DESC
+    """, (user_id,))
+    for chat_id, name, chat_type, message_id, sender, preview, payload, ts, unread in c:
+        participant_usernames = participants.get(chat_id, [])
+        last_message = None
+        if message_id is not None:
+            last_message = {"id": message_id, "sender": sender}
+            if chat_type == 'private':
+                last_message.update(e2ee_fields(payload))
+            else:
+                last_message["content"] = preview
+            last_message["timestamp"] = ts
+
+        display_name = name
+        if chat_type == "private":
+            others = [u for u in participant_usernames if u != username]
+            if others:
+                display_name = others[0]
+        yield {
+            "chat_id":      chat_id,
+            "name":         display_name,
+            "type":         chat_type,
+            "participants": participant_usernames,
+            "last_message": last_message,
+            "unread":       unread
+        }
+
+
+def mark_read(c, user_id, chat_id, chat_type, message_id=None):
+    """ Move the user's read marker forward and recount unread; None if not a member.
+
+    The marker never passes the chat's last message, so ids that do not
+    exist yet cannot hide later messages from the unread count.
+    """
+    table = "e2eemessages" if chat_type == 'private' else "plainmessages"
+    c.execute(f"""
+        UPDATE chat_summaries
+        SET last_read_id = MAX(last_read_id, MIN(COALESCE(?, last_message_id, 0), COALESCE(last_message_id, 0))),
+            unread_count = (
+                SELECT COUNT(*) FROM {table} m
+                WHERE m.chat_id = chat_summaries.chat_id
+                  AND m.id > MAX(chat_summaries.last_read_id, MIN(
+                      COALESCE(?, chat_summaries.last_message_id, 0), COALESCE(chat_summaries.last_message_id, 0)))
+                  AND m.sender_id != (SELECT username FROM users WHERE id = chat_summaries.user_id)
+            )
+        WHERE user_id = ? AND chat_id = ?
+    """, (message_id, message_id, user_id, chat_id))
+    c.execute(
+        "SELECT last_read_id, unread_count FROM chat_summaries WHERE user_id = ? AND chat_id = ?",
+        (user_id, chat_id)
+    )
+    return c.fetchone()
+
+
+def _table_head(c, table):
+    # sqlite_sequence keeps the highest id ever issued, so the head does not
+    # go backwards when the newest rows are archived or deleted
+    c.execute(f"""
+        SELECT MAX(
+            COALESCE((SELECT MAX(id) FROM {table}), 0),
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0)
+        )
+    """, (table,))
+    return c.fetchone()[0]
+
+
+def load_message_changes(c, user_id, chat_type, after, chat_marks, limit, binary=False):
+    """ Messages newer than the watermarks in the user's chats of one table.
+
+    ``chat_marks`` maps chat_id -> last seen id and overrides ``after`` for
+    those chats; with ``after`` None only the listed chats are checked.
+    Returns (messages, new watermark, has_more).
+    """
+    if chat_type == 'private':
+        table = "e2eemessages"
+        columns = "m.id, m.chat_id, u.username, m.payload, m.timestamp"
+        type_clause = "ch.type = 'private'"
+    else:
+        table = "plainmessages"
+        columns = "m.id, m.chat_id, u.username, m.content, m.timestamp"
+        type_clause = "ch.type != 'private'"
+
+    # Read the head first so rows committed during the query are left for
+    # the next sync instead of being skipped by the returned watermark.
+    head = _table_head(c, table)
+    c.execute(f"""
+        WITH marks(chat_id, after) AS (
+            SELECT CAST(key AS INTEGER), CAST(value AS INTEGER) FROM json_each(?)
+        )
+        SELECT {columns}
+        FROM chat_participants cp
+        JOIN chats ch ON ch.id = cp.chat_id AND {type_clause}
+        LEFT JOIN marks mk ON mk.chat_id = cp.chat_id
+        JOIN {table} m ON m.chat_id = cp.chat_id
+                      AND m.id > COALESCE(mk.after, ?)
+                      AND m.id <= ?
+        JOIN users u ON m.sender_id = u.username
+        WHERE cp.user_id = ?
+        ORDER BY m.id
+        LIMIT ?
+    """, (json.dumps(chat_marks), after, head, user_id, limit + 1))
+    rows = c.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if chat_type == 'private':
+        messages = [
+            {
+                "id":        message_id,
+                "chat_id":   chat_id,
+                "sender":    sender_name,
+                **e2ee_fields(payload, binary),
+                "timestamp": ts
+            }
+            for message_id, chat_id, sender_name, payload, ts in rows
+        ]
+    else:
+        messages = [
+            {
+                "id":        message_id,
+                "chat_id":   chat_id,
+                "sender":    sender_name,
+                "content":   content,
+                "timestamp": ts
+            }
+            for message_id, chat_id, sender_name, content, ts in rows
+        ]
+    watermark = rows[-1][0] if has_more else head
+    return messages, watermark, has_more
+
+
+def load_participant_changes(c, user_id, after, limit):
+    """ Join/leave events after the watermark for the user's chats and for the user.
+
+    Returns (events, new watermark, has_more).
+    """
+    head = _table_head(c, "participant_events")
+    c.execute("""
+        SELECT pe.id, pe.chat_id, u.username, pe.event
+        FROM participant_events pe
+        JOIN users u ON u.id = pe.user_id
+        WHERE pe.id > ? AND pe.id <= ?
+          AND (pe.user_id = ?
+               OR pe.chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = ?))
+        ORDER BY pe.id
+        LIMIT ?
+    """, (after, head, user_id, user_id, limit + 1))
+    rows = c.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    events = [
+        {"id": event_id, "chat_id": chat_id, "username": username, "event": event}
+        for event_id, chat_id, username, event in rows
+    ]
+    watermark = rows[-1][0] if has_more else head
+    return events, watermark, has_more
@@ -0,0 +1,229 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import FETCH_SECONDS, QUERY_ROWS, QUERY_SECONDS, statement_label
+from offload import run_blocking
+
+DB_PATH = os.environ.get('CHAT_APP_DB', 'chat_app.db')
+POOL_SIZE = int(os.environ.get('CHAT_APP_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('CHAT_APP_DB_POOL_TIMEOUT', '5'))
+ITER_BATCH = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """ Raised when no pooled connection became free within the wait limit """
+
+
+class InstrumentedCursor:
+    """ Cursor that times statements per label and runs them off the event loop when cooperative """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._label = 'other'
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        # Batches keep memory flat when rows are consumed as they are sent
+        while True:
+            rows = self.fetchmany(ITER_BATCH)
+            if not rows:
+                return
+            yield from rows
+
+    def _run(self, method, sql, *args):
+        self._label = statement_label(sql)
+        start = time.perf_counter()
+        try:
+            run_blocking(method, sql, *args)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - start, self._label)
+        if self._cursor.rowcount > 0:
+            QUERY_ROWS.inc(self._label, amount=self._cursor.rowcount)
+        return self
+
+    def execute(self, sql, *args):
+        return self._run(self._cursor.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._run(self._cursor.executemany, sql, *args)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = run_blocking(method, *args)
+        FETCH_SECONDS.inc(self._label, amount=time.perf_counter() - start)
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is not None:
+            QUERY_ROWS.inc(self._label)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(self._cursor.fetchmany, *args)
+        QUERY_ROWS.inc(self._label, amount=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        QUERY_ROWS.inc(self._label, amount=len(rows))
+        return rows
+
+
+class PooledConnection:
+    """ A sqlite3 connection whose close() hands it back to the pool """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor())
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        run_blocking(self._conn.commit)
+
+    def rollback(self):
+        run_blocking(self._conn.rollback)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """ Fixed-size pool of pre-configured SQLite connections """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT, foreign_keys=True):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.foreign_keys = foreign_keys
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if self.foreign_keys else 'OFF'}")
+        return conn
+
+    def acquire(self):
+        """ Return an idle connection, opening one if the pool is not full yet """
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = run_blocking(self._connect)
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout("Timed out waiting for a database connection")
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            if waited > 0.001:
+                self._waits += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """ Roll back anything left open and return the connection to the idle set """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def stats(self):
+        """ Snapshot of pool size and wait-time counters """
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquired": self._acquired,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": self._wait_total,
+                "wait_seconds_max": self._wait_max,
+            }
+
+    def close_all(self):
+        """ Close every idle connection """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+pool = ConnectionPool()
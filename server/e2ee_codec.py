@@ -0,0 +1,62 @@
+import base64
+import binascii
+
+# E2EE messages are stored as one BLOB instead of three base64 TEXT columns.
+#
+#   fixed layout     0x01 | iv (16) | tag (32) | ct
+#   variable layout  0x02 | len(iv) (1) | len(tag) (1) | iv | tag | ct
+#
+# The fixed layout matches the client's AES-CBC IV and HMAC-SHA256 tag; the
+# variable one only exists so unexpected sizes round-trip instead of failing.
+IV_LEN = 16
+TAG_LEN = 32
+FIXED = 0x01
+VARIABLE = 0x02
+
+
+def pack(iv, ct, tag):
+    """ Pack raw iv/ct/tag bytes into a single payload """
+    if len(iv) == IV_LEN and len(tag) == TAG_LEN:
+        return bytes((FIXED,)) + iv + tag + ct
+    if len(iv) > 255 or len(tag) > 255:
+        raise ValueError("iv and tag must be at most 255 bytes")
+    return bytes((VARIABLE, len(iv), len(tag))) + iv + tag + ct
+
+
+def unpack(payload):
+    """ Split a payload back into (iv, ct, tag) bytes """
+    payload = bytes(payload)
+    if not payload:
+        raise ValueError("Empty E2EE payload")
+    if payload[0] == FIXED:
+        iv_len, tag_len, offset = IV_LEN, TAG_LEN, 1
+    elif payload[0] == VARIABLE:
+        iv_len, tag_len, offset = payload[1], payload[2], 3
+    else:
+        raise ValueError(f"Unknown E2EE payload layout {payload[0]}")
+    iv = payload[offset:offset + iv_len]
+    tag = payload[offset + iv_len:offset + iv_len + tag_len]
+    ct = payload[offset + iv_len + tag_len:]
+    return iv, ct, tag
+
+
+def _b64decode(value):
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, TypeError) as e:
+        raise ValueError("iv, ct and tag must be base64") from e
+
+
+def pack_b64(iv, ct, tag):
+    """ Pack the base64 strings the client sends """
+    return pack(_b64decode(iv), _b64decode(ct), _b64decode(tag))
+
+
+def unpack_b64(payload):
+    """ Unpack into the base64 iv/ct/tag fields of the JSON API """
+    iv, ct, tag = unpack(payload)
+    return {
+        "iv":  base64.b64encode(iv).decode('ascii'),
+        "ct":  base64.b64encode(ct).decode('ascii'),
+        "tag": base64.b64encode(tag).decode('ascii'),
+    }
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from metrics import Histogram
+from offload import offloading, run_blocking
+
+# Every Argon2 call holds memory_cost (64 MiB) for its duration, so the worker
+# count bounds hashing memory and the queue limit bounds how long a login can
+# wait before we turn it away with a 503.
+HASH_WORKERS = int(os.environ.get('CHAT_APP_HASH_WORKERS', '2'))
+HASH_QUEUE_LIMIT = int(os.environ.get('CHAT_APP_HASH_QUEUE_LIMIT', '8'))
+HASH_TIMEOUT = float(os.environ.get('CHAT_APP_HASH_TIMEOUT', '10'))
+RETRY_AFTER_SECONDS = 1
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HASH_SECONDS = Histogram('chat_argon2_seconds', 'Argon2 compute time per call, excluding queueing',
+                         ('op',), buckets=LATENCY_BUCKETS)
+
+ph = PasswordHasher(
+    time_cost=3,
+    memory_cost=65536,
+    parallelism=4,
+    salt_len=16,
+    hash_len=32,
+)
+
+
+class HashPoolSaturated(Exception):
+    """ Raised when the hashing pool is full or a queued call waited past its timeout """
+
+
+class HashingPool:
+    """ Bounded executor for Argon2 work with admission control and latency counters """
+
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="argon2")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        # Under eventlet/gevent the executor's threads would be green, so
+        # hashes go to the hub's native thread pool, capped at `workers`.
+        self._running = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._calls = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._buckets = [0] * len(LATENCY_BUCKETS)
+
+    def run(self, fn, *args):
+        """ Run fn on the pool and wait for its result, or raise HashPoolSaturated """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashPoolSaturated("Password hashing is saturated")
+
+        with self._lock:
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            if offloading():
+                try:
+                    with self._running:
+                        return run_blocking(fn, *args)
+                finally:
+                    self._slots.release()
+            try:
+                future = self._executor.submit(fn, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+            # The slot follows the call, not the caller: a hash we stopped
+            # waiting for still occupies the executor until it finishes
+            future.add_done_callback(lambda _: self._slots.release())
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                with self._lock:
+                    self._timeouts += 1
+                raise HashPoolSaturated("Password hashing timed out")
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def _record(self, elapsed):
+        with self._lock:
+            self._in_flight -= 1
+            self._calls += 1
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    self._buckets[i] += 1
+                    break
+
+    def stats(self):
+        """ Snapshot of queue depth, rejections and per-call latency """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self._in_flight,
+                "calls": self._calls,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "latency_seconds_total": self._latency_total,
+                "latency_seconds_max": self._latency_max,
+                "latency_buckets": dict(zip(LATENCY_BUCKETS, self._buckets)),
+            }
+
+
+hash_pool = HashingPool()
+
+
+def _hash(password):
+    start = time.perf_counter()
+    try:
+        return ph.hash(password)
+    finally:
+        HASH_SECONDS.observe(time.perf_counter() - start, 'hash')
+
+
+def _verify(password_hash, password):
+    start = time.perf_counter()
+    try:
+        return ph.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+    finally:
+        HASH_SECONDS.observe(time.perf_counter() - start, 'verify')
+
+
+def argon2_hash(password):
+    """ Argon2-hash password on the hashing pool """
+    return hash_pool.run(_hash, password)
+
+
+def argon2_verify(password_hash, password):
+    """ Check password against an Argon2 hash on the hashing pool """
+    return hash_pool.run(_verify, password_hash, password)
@@ -0,0 +1,185 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+# One JSON object per line on stderr. Records are formatted on the calling
+# thread but written by a listener thread, so a slow terminal or pipe never
+# blocks a request; when the queue is full, records are dropped and counted.
+#
+# Successful requests are sampled per endpoint; errors and slow requests are
+# always logged. CHAT_APP_LOG_SAMPLE_RATES overrides the per-route rates,
+# e.g. "getdashboard=0.01,ping=0".
+LOG_LEVEL = os.environ.get('CHAT_APP_LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('CHAT_APP_LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLE_RATE = float(os.environ.get('CHAT_APP_LOG_SAMPLE_RATE', '1.0'))
+SLOW_REQUEST_MS = float(os.environ.get('CHAT_APP_SLOW_REQUEST_MS', '500'))
+
+ROUTE_SAMPLE_RATES = {
+    'ping': 0.0,
+    'getchats': 0.1,
+    'getmessages': 0.1,
+    'getdashboard': 0.1,
+    'gettasks': 0.1,
+    'gettimetable': 0.1,
+    'sync': 0.1,
+}
+
+# Values under these keys never reach the log, at any depth
+REDACTED_KEYS = frozenset({
+    'password', 'salt', 'hash', 'token', 'authorization', 'cookie', 'publickey', 'public_key',
+    'iv', 'ct', 'tag', 'payload', 'message', 'content',
+})
+REDACTED = '[redacted]'
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+log = logging.getLogger('chat_app')
+_listener = None
+dropped = 0
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        route, _, rate = item.partition('=')
+        rates[route.strip()] = float(rate)
+    return rates
+
+
+ROUTE_SAMPLE_RATES.update(_parse_rates(os.environ.get('CHAT_APP_LOG_SAMPLE_RATES', '')))
+
+
+def redact(value):
+    """ Copy value with every sensitive key masked """
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if str(k).lower() in REDACTED_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = REDACTED if key.lower() in REDACTED_KEYS else redact(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    """ Tag records logged inside a request with its id, route and user """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.endpoint
+            if g.get('user_id') is not None:
+                record.user_id = g.user_id
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+    def prepare(self, record):
+        # Format here, so the listener only writes finished lines
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, stream=None):
+    """ Route the chat_app loggers through a bounded queue to a writer thread """
+    global _listener
+    if _listener is not None:
+        return log
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(logging.Formatter('%(message)s'))
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RequestContextFilter())
+    log.addHandler(handler)
+    log.setLevel(level)
+    log.propagate = False
+    _listener = QueueListener(handler.queue, writer)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return log
+
+
+def get_logger(name):
+    return log.getChild(name)
+
+
+def sample_rate(endpoint):
+    return ROUTE_SAMPLE_RATES.get(endpoint, LOG_SAMPLE_RATE)
+
+
+def init_app(app):
+    """ Log one sampled line per request: route, status, latency and user """
+    access = get_logger('access')
+    # Unhandled exceptions go through the same queue instead of Flask's stderr handler
+    app.logger.removeHandler(default_handler)
+    for handler in log.handlers:
+        app.logger.addHandler(handler)
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.request_id = request.headers.get("X-Request-ID", "")[:64] or uuid.uuid4().hex[:16]
+
+    @app.after_request
+    def _log_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        always = response.status_code >= 500 or elapsed_ms >= SLOW_REQUEST_MS
+        if always or random.random() < sample_rate(request.endpoint):
+            level = logging.WARNING if always else logging.INFO
+            fields = {
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(elapsed_ms, 2),
+                "query": redact(request.args.to_dict()),
+            }
+            if access.isEnabledFor(logging.DEBUG) and request.is_json:
+                fields["body"] = redact(request.get_json(silent=True))
+            access.log(level, "request", extra=fields)
+        response.headers['X-Request-ID'] = g.request_id
+        return response
+
+
+def stats():
+    return {"dropped": dropped, "queued": _listener.queue.qsize() if _listener else 0}
@@ -0,0 +1,208 @@
+import bisect
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, g, request
+
+# In-process metrics in the Prometheus text format. Recording is a dict
+# lookup and an add under a lock; anything that already keeps its own
+# counters (pool, hashing, write batcher, ...) is read only at scrape time.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield self.name + _labels(self.labelnames, labelvalues), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labelvalues)
+            if row is None:
+                row = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labelvalues, list(row)) for labelvalues, row in self._values.items()]
+        for labelvalues, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), row):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield self.name + '_bucket' + _labels(self.labelnames, labelvalues, le), cumulative
+            yield self.name + '_sum' + _labels(self.labelnames, labelvalues), row[-1]
+            yield self.name + '_count' + _labels(self.labelnames, labelvalues), cumulative
+
+
+class StatsGauges:
+    """ Export the numeric fields of a component's stats() as gauges at scrape time """
+    kind = 'gauge'
+
+    def __init__(self, prefix, help, stats):
+        self.name = prefix
+        self.help = help
+        self.stats = stats
+        _registry.append(self)
+
+    def samples(self):
+        for key, value in self.stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{self.name}_{key}', value
+
+
+class CallbackGauge:
+    """ A gauge whose value is computed when /metrics is scraped """
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        _registry.append(self)
+
+    def samples(self):
+        yield self.name, self.fn()
+
+
+def render():
+    """ Every registered metric in the Prometheus text exposition format """
+    lines = []
+    for metric in _registry:
+        if isinstance(metric, StatsGauges):
+            for sample, value in metric.samples():
+                lines += [f'# HELP {sample} {metric.help}', f'# TYPE {sample} gauge', f'{sample} {_number(value)}']
+            continue
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for sample, value in metric.samples():
+            lines.append(f'{sample} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUESTS = Counter('chat_http_requests_total', 'HTTP requests by endpoint, method and status',
+                   ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('chat_http_request_duration_seconds', 'HTTP request latency by endpoint',
+                            ('endpoint',))
+QUERY_SECONDS = Histogram('chat_db_query_seconds', 'SQLite statement execution time by statement',
+                          ('statement',), buckets=QUERY_BUCKETS)
+FETCH_SECONDS = Counter('chat_db_fetch_seconds_total', 'Time spent fetching result rows by statement',
+                        ('statement',))
+QUERY_ROWS = Counter('chat_db_rows_total', 'Rows fetched or changed by statement', ('statement',))
+
+
+_PARENS = re.compile(r'\([^()]*\)')
+_WORD = re.compile(r'[\w.]+')
+_TARGET = {'select': 'from', 'delete': 'from', 'insert': 'into', 'replace': 'into', 'update': 'update'}
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql):
+    """ A low-cardinality label such as 'select:users' for a SQL string """
+    # Drop parenthesised parts (CTE bodies, subqueries, column lists) so the
+    # first FROM/INTO left is the statement's own table
+    flat, previous = sql.lower(), None
+    while flat != previous:
+        flat, previous = _PARENS.sub(' ', flat), flat
+    words = _WORD.findall(flat)
+    if not words:
+        return 'other'
+    verb = words[0]
+    if verb == 'with':
+        verb = next((w for w in words if w in _TARGET), 'with')
+    keyword = _TARGET.get(verb)
+    if keyword in words:
+        i = words.index(keyword)
+        if i + 1 < len(words):
+            return f'{verb}:{words[i + 1]}'
+    return verb
+
+
+def init_app(app):
+    """ Count and time every request by endpoint """
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+            REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+
+def metrics_response():
+    return Response(render(), mimetype=CONTENT_TYPE)
@@ -0,0 +1,590 @@
+import sqlite3
+from sqlite3 import Error
+
+from db import DB_PATH
+from e2ee_codec import pack, pack_b64
+from logs import get_logger
+from timetable import MAX_SLOT_MINUTES, MINUTES_PER_DAY, MINUTES_PER_WEEK, day_index, format_span, minute_of_day
+
+log = get_logger('migrations')
+
+# Each migration is (version, name, steps). A step is either a SQL string or a
+# callable taking the cursor. Versions are applied in order, each in its own
+# transaction, and recorded in schema_migrations so reruns are no-ops.
+
+INITIAL_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        salt TEXT NOT NULL,
+        password TEXT NOT NULL,
+        public_key TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        name TEXT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''', #id, 그룹또는 개인 구분, 채팅이름, 생성일
+    '''
+    CREATE TABLE IF NOT EXISTS chat_participants (
+          chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+          user_id TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+          PRIMARY KEY (chat_id, user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS plainmessages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+        sender_id TEXT NOT NULL REFERENCES users(username),
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS e2eemessages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+        sender_id TEXT NOT NULL REFERENCES users(username),
+        iv TEXT NOT NULL,
+        ct TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS dashboard (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS timetable (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        day TEXT NOT NULL,
+        time TEXT NOT NULL,
+        duration INTEGER NOT NULL,
+        content TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tasks (
+        id               INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id         INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+        participant_name TEXT    NOT NULL,
+        task_name        TEXT    NOT NULL,
+        deadline         DATE    NOT NULL,
+        status           TEXT    NOT NULL DEFAULT 'In Progess',
+        created_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(group_id, task_name)
+    )
+    ''',
+]
+
+# History pages and last-message previews key on (chat_id, id); id order is
+# insertion order, which is also timestamp order.
+SECONDARY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_plainmessages_chat_id ON plainmessages (chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_e2eemessages_chat_id ON e2eemessages (chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_participants_user ON chat_participants (user_id, chat_id)",
+    "CREATE INDEX IF NOT EXISTS idx_timetable_username ON timetable (username)",
+    "CREATE INDEX IF NOT EXISTS idx_dashboard_created_at ON dashboard (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_group_status ON tasks (group_id, status)",
+]
+
+# chat_participants.user_id has always held users.id, but was declared as a
+# TEXT reference to users(username), so foreign key enforcement rejected it.
+FIX_PARTICIPANT_REFERENCE = [
+    '''
+    CREATE TABLE chat_participants_new (
+          chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+          user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+          PRIMARY KEY (chat_id, user_id)
+    )
+    ''',
+    '''
+    INSERT OR IGNORE INTO chat_participants_new (chat_id, user_id)
+    SELECT chat_id, CAST(user_id AS INTEGER) FROM chat_participants
+    ''',
+    "DROP TABLE chat_participants",
+    "ALTER TABLE chat_participants_new RENAME TO chat_participants",
+    "CREATE INDEX IF NOT EXISTS idx_chat_participants_user ON chat_participants (user_id, chat_id)",
+]
+
+SESSIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        token      TEXT PRIMARY KEY,
+        user_id    INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        username   TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)",
+]
+
+# Append-only log of membership changes, so reconnecting clients can ask
+# for joins and leaves after a watermark instead of re-reading every chat.
+PARTICIPANT_EVENTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS participant_events (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id    INTEGER NOT NULL,
+        user_id    INTEGER NOT NULL,
+        event      TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_participant_events_user ON participant_events (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_participant_events_chat ON participant_events (chat_id, id)",
+    '''
+    CREATE TRIGGER IF NOT EXISTS chat_participants_join AFTER INSERT ON chat_participants
+    BEGIN
+        INSERT INTO participant_events (chat_id, user_id, event) VALUES (NEW.chat_id, NEW.user_id, 'join');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS chat_participants_leave AFTER DELETE ON chat_participants
+    BEGIN
+        INSERT INTO participant_events (chat_id, user_id, event) VALUES (OLD.chat_id, OLD.user_id, 'leave');
+    END
+    ''',
+]
+
+def pack_e2ee_payloads(c):
+    """ Rebuild e2eemessages with one binary payload column instead of iv/ct/tag TEXT """
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'e2eemessages'")
+    row = c.fetchone()
+    seq = row[0] if row else 0
+    c.execute('''
+        CREATE TABLE e2eemessages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+            sender_id TEXT NOT NULL REFERENCES users(username),
+            payload BLOB NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    rows = c.execute("SELECT id, chat_id, sender_id, iv, ct, tag, timestamp FROM e2eemessages").fetchall()
+    packed, raw, skipped = [], 0, 0
+    for message_id, chat_id, sender_id, iv, ct, tag, ts in rows:
+        try:
+            payload = pack_b64(iv, ct, tag)
+        except ValueError:
+            # Legacy rows could hold any text; keep its bytes in the variable
+            # layout rather than failing the migration, and only drop rows
+            # that do not even fit that
+            try:
+                payload = pack(*(str(value or '').encode() for value in (iv, ct, tag)))
+                raw += 1
+            except ValueError:
+                skipped += 1
+                continue
+        packed.append((message_id, chat_id, sender_id, payload, ts))
+    if raw or skipped:
+        log.warning("E2EE rows with non-base64 fields", extra={"kept_raw": raw, "skipped": skipped})
+    c.executemany(
+        "INSERT INTO e2eemessages_new (id, chat_id, sender_id, payload, timestamp) VALUES (?, ?, ?, ?, ?)",
+        packed
+    )
+    c.execute("DROP TABLE e2eemessages")
+    c.execute("ALTER TABLE e2eemessages_new RENAME TO e2eemessages")
+    # Keep AUTOINCREMENT from reusing ids of messages deleted before the rebuild
+    c.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'e2eemessages'")
+    seq = max(seq, c.fetchone()[0])
+    c.execute("DELETE FROM sqlite_sequence WHERE name = 'e2eemessages'")
+    c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('e2eemessages', ?)", (seq,))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_e2eemessages_chat_id ON e2eemessages (chat_id, id)")
+
+
+# External-content FTS5 indexes, kept in sync by triggers. Messages are
+# indexed through a view that adds a "c<chat_id>" token, so a search can be
+# narrowed to the caller's chats inside the index instead of after it.
+FULL_TEXT_SEARCH = [
+    '''
+    CREATE VIEW IF NOT EXISTS plainmessages_search AS
+    SELECT id, content, 'c' || chat_id AS chat FROM plainmessages
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS plainmessages_fts USING fts5(
+        content, chat,
+        content = 'plainmessages_search', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS plainmessages_fts_insert AFTER INSERT ON plainmessages
+    BEGIN
+        INSERT INTO plainmessages_fts (rowid, content, chat) VALUES (NEW.id, NEW.content, 'c' || NEW.chat_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS plainmessages_fts_delete AFTER DELETE ON plainmessages
+    BEGIN
+        INSERT INTO plainmessages_fts (plainmessages_fts, rowid, content, chat)
+        VALUES ('delete', OLD.id, OLD.content, 'c' || OLD.chat_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS plainmessages_fts_update AFTER UPDATE OF content, chat_id ON plainmessages
+    BEGIN
+        INSERT INTO plainmessages_fts (plainmessages_fts, rowid, content, chat)
+        VALUES ('delete', OLD.id, OLD.content, 'c' || OLD.chat_id);
+        INSERT INTO plainmessages_fts (rowid, content, chat) VALUES (NEW.id, NEW.content, 'c' || NEW.chat_id);
+    END
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS dashboard_fts USING fts5(
+        title, content,
+        content = 'dashboard', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS dashboard_fts_insert AFTER INSERT ON dashboard
+    BEGIN
+        INSERT INTO dashboard_fts (rowid, title, content) VALUES (NEW.id, NEW.title, NEW.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS dashboard_fts_delete AFTER DELETE ON dashboard
+    BEGIN
+        INSERT INTO dashboard_fts (dashboard_fts, rowid, title, content)
+        VALUES ('delete', OLD.id, OLD.title, OLD.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS dashboard_fts_update AFTER UPDATE OF title, content ON dashboard
+    BEGIN
+        INSERT INTO dashboard_fts (dashboard_fts, rowid, title, content)
+        VALUES ('delete', OLD.id, OLD.title, OLD.content);
+        INSERT INTO dashboard_fts (rowid, title, content) VALUES (NEW.id, NEW.title, NEW.content);
+    END
+    ''',
+    "INSERT INTO plainmessages_fts (plainmessages_fts) VALUES ('rebuild')",
+    "INSERT INTO dashboard_fts (dashboard_fts) VALUES ('rebuild')",
+]
+
+# One row per (user, chat) with the newest message and the user's unread
+# count, maintained by triggers so the chat list never touches the message
+# tables. Plain chats keep a text preview, private chats the E2EE payload.
+CHAT_SUMMARIES = [
+    '''
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id         INTEGER NOT NULL,
+        chat_id         INTEGER NOT NULL,
+        last_message_id INTEGER,
+        last_sender     TEXT,
+        last_preview    TEXT,
+        last_payload    BLOB,
+        last_timestamp  TIMESTAMP,
+        last_read_id    INTEGER NOT NULL DEFAULT 0,
+        unread_count    INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, chat_id)
+    ) WITHOUT ROWID
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_chat_summaries_chat ON chat_summaries (chat_id, user_id)",
+    '''
+    INSERT OR IGNORE INTO chat_summaries
+        (user_id, chat_id, last_message_id, last_sender, last_preview, last_timestamp, last_read_id)
+    SELECT cp.user_id, cp.chat_id, m.id, m.sender_id, substr(m.content, 1, 200), m.timestamp, COALESCE(m.id, 0)
+    FROM chat_participants cp
+    JOIN chats ch ON ch.id = cp.chat_id AND ch.type != 'private'
+    LEFT JOIN plainmessages m ON m.id = (SELECT MAX(id) FROM plainmessages WHERE chat_id = cp.chat_id)
+    ''',
+    '''
+    INSERT OR IGNORE INTO chat_summaries
+        (user_id, chat_id, last_message_id, last_sender, last_payload, last_timestamp, last_read_id)
+    SELECT cp.user_id, cp.chat_id, m.id, m.sender_id, m.payload, m.timestamp, COALESCE(m.id, 0)
+    FROM chat_participants cp
+    JOIN chats ch ON ch.id = cp.chat_id AND ch.type = 'private'
+    LEFT JOIN e2eemessages m ON m.id = (SELECT MAX(id) FROM e2eemessages WHERE chat_id = cp.chat_id)
+    ''',
+    # Members who join later start with the chat's history marked as read
+    '''
+    CREATE TRIGGER IF NOT EXISTS chat_summaries_join AFTER INSERT ON chat_participants
+    BEGIN
+        INSERT OR IGNORE INTO chat_summaries (user_id, chat_id) VALUES (NEW.user_id, NEW.chat_id);
+        UPDATE chat_summaries
+        SET (last_message_id, last_sender, last_preview, last_timestamp, last_read_id) = (
+            SELECT id, sender_id, substr(content, 1, 200), timestamp, id
+            FROM plainmessages WHERE chat_id = NEW.chat_id ORDER BY id DESC LIMIT 1
+        )
+        WHERE user_id = NEW.user_id AND chat_id = NEW.chat_id
+          AND EXISTS (SELECT 1 FROM plainmessages WHERE chat_id = NEW.chat_id);
+        UPDATE chat_summaries
+        SET (last_message_id, last_sender, last_payload, last_timestamp, last_read_id) = (
+            SELECT id, sender_id, payload, timestamp, id
+            FROM e2eemessages WHERE chat_id = NEW.chat_id ORDER BY id DESC LIMIT 1
+        )
+        WHERE user_id = NEW.user_id AND chat_id = NEW.chat_id
+          AND EXISTS (SELECT 1 FROM e2eemessages WHERE chat_id = NEW.chat_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS chat_summaries_leave AFTER DELETE ON chat_participants
+    BEGIN
+        DELETE FROM chat_summaries WHERE user_id = OLD.user_id AND chat_id = OLD.chat_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS chat_summaries_plain AFTER INSERT ON plainmessages
+    WHEN (SELECT type FROM chats WHERE id = NEW.chat_id) != 'private'
+    BEGIN
+        UPDATE chat_summaries
+        SET last_message_id = NEW.id,
+            last_sender     = NEW.sender_id,
+            last_preview    = substr(NEW.content, 1, 200),
+            last_payload    = NULL,
+            last_timestamp  = NEW.timestamp,
+            unread_count    = CASE WHEN user_id = (SELECT id FROM users WHERE username = NEW.sender_id)
+                                   THEN 0 ELSE unread_count + 1 END,
+            last_read_id    = CASE WHEN user_id = (SELECT id FROM users WHERE username = NEW.sender_id)
+                                   THEN NEW.id ELSE last_read_id END
+        WHERE chat_id = NEW.chat_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS chat_summaries_e2ee AFTER INSERT ON e2eemessages
+    WHEN (SELECT type FROM chats WHERE id = NEW.chat_id) = 'private'
+    BEGIN
+        UPDATE chat_summaries
+        SET last_message_id = NEW.id,
+            last_sender     = NEW.sender_id,
+            last_preview    = NULL,
+            last_payload    = NEW.payload,
+            last_timestamp  = NEW.timestamp,
+            unread_count    = CASE WHEN user_id = (SELECT id FROM users WHERE username = NEW.sender_id)
+                                   THEN 0 ELSE unread_count + 1 END,
+            last_read_id    = CASE WHEN user_id = (SELECT id FROM users WHERE username = NEW.sender_id)
+                                   THEN NEW.id ELSE last_read_id END
+        WHERE chat_id = NEW.chat_id;
+    END
+    ''',
+]
+
+# Unfinished tasks per group, kept by triggers so finishing a task does not
+# recount the group
+TASK_PROGRESS = [
+    '''
+    CREATE TABLE IF NOT EXISTS task_progress (
+        group_id   INTEGER PRIMARY KEY,
+        open_tasks INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    INSERT OR REPLACE INTO task_progress (group_id, open_tasks)
+    SELECT group_id, SUM(status != 'Finished') FROM tasks GROUP BY group_id
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS task_progress_insert AFTER INSERT ON tasks
+    BEGIN
+        INSERT INTO task_progress (group_id, open_tasks) VALUES (NEW.group_id, NEW.status != 'Finished')
+        ON CONFLICT (group_id) DO UPDATE SET open_tasks = open_tasks + excluded.open_tasks;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS task_progress_delete AFTER DELETE ON tasks
+    BEGIN
+        UPDATE task_progress SET open_tasks = open_tasks - (OLD.status != 'Finished')
+        WHERE group_id = OLD.group_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS task_progress_update AFTER UPDATE OF status, group_id ON tasks
+    BEGIN
+        UPDATE task_progress SET open_tasks = open_tasks - (OLD.status != 'Finished')
+        WHERE group_id = OLD.group_id;
+        INSERT INTO task_progress (group_id, open_tasks) VALUES (NEW.group_id, NEW.status != 'Finished')
+        ON CONFLICT (group_id) DO UPDATE SET open_tasks = open_tasks + excluded.open_tasks;
+    END
+    ''',
+]
+
+# task_progress.version moves on every task change in the group, so cached
+# task lists can be checked against it from any worker process
+TASK_VERSIONS = [
+    "ALTER TABLE task_progress ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+    "UPDATE task_progress SET version = 1",
+    "DROP TRIGGER IF EXISTS task_progress_insert",
+    "DROP TRIGGER IF EXISTS task_progress_delete",
+    "DROP TRIGGER IF EXISTS task_progress_update",
+    '''
+    CREATE TRIGGER task_progress_insert AFTER INSERT ON tasks
+    BEGIN
+        INSERT INTO task_progress (group_id, open_tasks, version) VALUES (NEW.group_id, NEW.status != 'Finished', 1)
+        ON CONFLICT (group_id) DO UPDATE SET open_tasks = open_tasks + excluded.open_tasks, version = version + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER task_progress_delete AFTER DELETE ON tasks
+    BEGIN
+        UPDATE task_progress SET open_tasks = open_tasks - (OLD.status != 'Finished'), version = version + 1
+        WHERE group_id = OLD.group_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER task_progress_update AFTER UPDATE ON tasks
+    BEGIN
+        UPDATE task_progress SET open_tasks = open_tasks - (OLD.status != 'Finished'), version = version + 1
+        WHERE group_id = OLD.group_id;
+        INSERT INTO task_progress (group_id, open_tasks, version) VALUES (NEW.group_id, NEW.status != 'Finished', 1)
+        ON CONFLICT (group_id) DO UPDATE SET open_tasks = open_tasks + excluded.open_tasks, version = version + 1;
+    END
+    ''',
+]
+
+
+def timetable_minutes(c):
+    """ Add minute-of-week start/end columns to timetable and fill them from day/time/duration """
+    c.execute("ALTER TABLE timetable ADD COLUMN start_minute INTEGER")
+    c.execute("ALTER TABLE timetable ADD COLUMN end_minute INTEGER")
+    rows = c.execute("SELECT id, day, time, duration FROM timetable").fetchall()
+    slots = []
+    for row_id, day, time, duration in rows:
+        # Existing rows are kept as they are; only unreadable ones stay unindexed
+        try:
+            start = day_index(day) * MINUTES_PER_DAY + minute_of_day(time)
+            end = min(start + int(duration) * 60, MINUTES_PER_WEEK)
+        except (TypeError, ValueError):
+            continue
+        slots.append((start, end, row_id))
+    c.executemany("UPDATE timetable SET start_minute = ?, end_minute = ? WHERE id = ?", slots)
+    split_long_slots(c)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_timetable_user_start ON timetable (username, start_minute, end_minute)")
+    c.execute("DROP INDEX IF EXISTS idx_timetable_username")
+
+
+def split_long_slots(c):
+    """ Split slots longer than MAX_SLOT_MINUTES into consecutive slots of at most that length.
+
+    Overlap and free-slot queries only look MAX_SLOT_MINUTES back from a
+    window, so no stored slot may be longer; legacy rows predate the cap.
+    """
+    rows = c.execute("""
+        SELECT id, username, content, start_minute, end_minute FROM timetable
+        WHERE end_minute - start_minute > ?
+    """, (MAX_SLOT_MINUTES,)).fetchall()
+    for row_id, username, content, start, end in rows:
+        pieces = [(lo, min(lo + MAX_SLOT_MINUTES, end)) for lo in range(start, end, MAX_SLOT_MINUTES)]
+        for i, (lo, hi) in enumerate(pieces):
+            day, time, _ = format_span(lo, hi)
+            hours = -(-(hi - lo) // 60)
+            if i == 0:
+                c.execute("""
+                    UPDATE timetable SET day = ?, time = ?, duration = ?, start_minute = ?, end_minute = ?
+                    WHERE id = ?
+                """, (day, time, hours, lo, hi, row_id))
+            else:
+                c.execute("""
+                    INSERT INTO timetable (username, day, time, duration, content, start_minute, end_minute)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (username, day, time, hours, content, lo, hi))
+    if rows:
+        log.info("Split long timetable slots", extra={"slots": len(rows)})
+
+
+# Where archived messages went; see archive.py
+ARCHIVE_SEGMENTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive_segments (
+        table_name TEXT NOT NULL,
+        period     TEXT NOT NULL,
+        path       TEXT NOT NULL,
+        min_id     INTEGER NOT NULL,
+        max_id     INTEGER NOT NULL,
+        rows       INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (table_name, period)
+    )
+    ''',
+]
+
+
+MIGRATIONS = [
+    (1, "initial tables", INITIAL_TABLES),
+    (2, "secondary indexes", SECONDARY_INDEXES),
+    (3, "chat_participants references users(id)", FIX_PARTICIPANT_REFERENCE),
+    (4, "sessions", SESSIONS),
+    (5, "participant events", PARTICIPANT_EVENTS),
+    (6, "binary e2ee payloads", [pack_e2ee_payloads]),
+    (7, "full-text search", FULL_TEXT_SEARCH),
+    (8, "chat summaries", CHAT_SUMMARIES),
+    (9, "task progress counters", TASK_PROGRESS),
+    (10, "task list versions", TASK_VERSIONS),
+    (11, "timetable minute-of-week slots", [timetable_minutes]),
+    (12, "archive segments", ARCHIVE_SEGMENTS),
+    # For databases that ran 11 before it split long slots
+    (13, "split long timetable slots", [split_long_slots]),
+]
+
+
+def applied_versions(c):
+    """ Return the set of migration versions already recorded """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in c.fetchall()}
+
+
+def run_migrations(path=DB_PATH, migrations=MIGRATIONS):
+    """ Apply every pending migration in version order; returns the versions applied """
+    # A dedicated autocommit connection with foreign keys off, so table
+    # rebuilds can run inside explicit transactions.
+    # Workers starting together wait on each other's migrations rather than
+    # failing on SQLite's default 5 s lock timeout
+    conn = sqlite3.connect(path, isolation_level=None, timeout=60)
+    applied = []
+    try:
+        c = conn.cursor()
+        c.execute("PRAGMA foreign_keys = OFF")
+        # Only takes effect before the first table exists; lets the archiver
+        # hand freed pages back with incremental_vacuum
+        c.execute("SELECT COUNT(*) FROM sqlite_master")
+        if c.fetchone()[0] == 0:
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        done = applied_versions(c)
+        for version, name, steps in sorted(migrations, key=lambda m: m[0]):
+            if version in done:
+                continue
+            c.execute("BEGIN IMMEDIATE")
+            # Another process may have applied it since applied_versions()
+            c.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,))
+            if c.fetchone() is not None:
+                c.execute("ROLLBACK")
+                continue
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(c)
+                    else:
+                        c.execute(step)
+                c.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+                    (version, name)
+                )
+                c.execute("COMMIT")
+            except (Error, ValueError):
+                c.execute("ROLLBACK")
+                log.exception("Migration failed", extra={"version": version, "migration": name})
+                raise
+            applied.append(version)
+            log.info("Applied migration", extra={"version": version, "migration": name})
+    finally:
+        conn.close()
+    return applied
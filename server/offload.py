@@ -0,0 +1,39 @@
+import os
+
+# Under eventlet or gevent every request is a greenlet on one OS thread, so a
+# blocking C call (sqlite3, argon2) stalls every socket on the box. When one of
+# those modes is configured, run_blocking() hands such calls to the hub's
+# native thread pool instead of running them inline.
+
+ASYNC_MODE = os.environ.get('CHAT_APP_ASYNC_MODE', '') or 'threading'
+
+_offload = None
+
+
+def configure(mode):
+    """ Select how blocking calls are run for the given async mode """
+    global _offload
+    if mode == 'eventlet':
+        from eventlet import tpool
+        _offload = tpool.execute
+    elif mode == 'gevent':
+        import gevent
+
+        def _offload(fn, *args, **kwargs):
+            return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    else:
+        _offload = None
+
+
+def offloading():
+    return _offload is not None
+
+
+def run_blocking(fn, *args, **kwargs):
+    """ Call fn off the event loop when running cooperatively, inline otherwise """
+    if _offload is None:
+        return fn(*args, **kwargs)
+    return _offload(fn, *args, **kwargs)
+
+
+configure(ASYNC_MODE)
@@ -0,0 +1,182 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+
+# The newest messages of recently used chats, kept in memory so opening a
+# chat or catching up after a reconnect does not read SQLite. Buffers are
+# created by reads (reserve, then fill from the newest-page query) and
+# extended by the write batcher right after each commit, in id order;
+# writes to chats nobody has read do not create buffers. Only a process that sees every write can
+# keep them current, so server.py turns this off when a message queue
+# shares rooms between several processes.
+RECENT_PER_CHAT = int(os.environ.get('CHAT_APP_RECENT_MESSAGES', '100'))
+RECENT_MAX_CHATS = int(os.environ.get('CHAT_APP_RECENT_CHATS', '2000'))
+RECENT_MAX_BYTES = int(float(os.environ.get('CHAT_APP_RECENT_CACHE_MB', '64')) * 1024 * 1024)
+
+# Rough per-row cost of the tuple, its ints and the timestamp string
+ROW_OVERHEAD = 160
+
+
+def _row_size(row):
+    return ROW_OVERHEAD + len(row[1]) + len(row[2])
+
+
+class _Buffer:
+    __slots__ = ('rows', 'ids', 'size', 'filled', 'has_older')
+
+    def __init__(self):
+        # (id, sender, content or payload, timestamp), oldest first
+        self.rows = []
+        self.ids = []
+        self.size = 0
+        # Only buffers seeded from the database hold every newer message;
+        # until then they just collect writes for the fill to merge
+        self.filled = False
+        self.has_older = False
+
+
+class RecentMessages:
+    """ Bounded per-chat ring buffers of the newest messages, LRU across chats.
+
+    Keys are (table, chat_id) so plain and E2EE rows never mix. A buffer
+    answers the newest page and ``after`` pages that start inside it; any
+    other page returns None and is read from the database.
+    """
+
+    def __init__(self, per_chat=RECENT_PER_CHAT, max_chats=RECENT_MAX_CHATS, max_bytes=RECENT_MAX_BYTES):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self._buffers = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.per_chat > 0
+
+    def _buffer(self, key):
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = _Buffer()
+        self._buffers.move_to_end(key)
+        return buf
+
+    def _insert(self, buf, row):
+        i = bisect.bisect_left(buf.ids, row[0])
+        if i < len(buf.ids) and buf.ids[i] == row[0]:
+            return
+        buf.ids.insert(i, row[0])
+        buf.rows.insert(i, row)
+        size = _row_size(row)
+        buf.size += size
+        self._bytes += size
+
+    def _trim(self, buf):
+        excess = len(buf.rows) - self.per_chat
+        if excess <= 0:
+            return
+        for row in buf.rows[:excess]:
+            size = _row_size(row)
+            buf.size -= size
+            self._bytes -= size
+        del buf.rows[:excess]
+        del buf.ids[:excess]
+        buf.has_older = True
+
+    def _evict(self):
+        while self._buffers and (len(self._buffers) > self.max_chats or self._bytes > self.max_bytes):
+            _, buf = self._buffers.popitem(last=False)
+            self._bytes -= buf.size
+            self.evictions += 1
+
+    def append(self, table, chat_id, row):
+        """ Record a committed message in the chat's buffer, if it has one """
+        if not self.enabled:
+            return
+        with self._lock:
+            buf = self._buffers.get((table, chat_id))
+            if buf is None:
+                return
+            self._buffers.move_to_end((table, chat_id))
+            self._insert(buf, row)
+            self._trim(buf)
+            self._evict()
+
+    def reserve(self, table, chat_id):
+        """ Start collecting a chat's writes before reading the rows for fill() """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._buffer((table, chat_id))
+            self._evict()
+
+    def fill(self, table, chat_id, rows, has_older):
+        """ Seed a chat's reserved buffer from its newest rows as read from the database """
+        if not self.enabled:
+            return
+        with self._lock:
+            buf = self._buffers.get((table, chat_id))
+            if buf is None:
+                # Evicted during the read, so writes since then were not kept
+                return
+            self._buffers.move_to_end((table, chat_id))
+            # Writes that committed after the read began are already buffered
+            for row in rows:
+                self._insert(buf, row)
+            buf.has_older = buf.has_older or has_older
+            buf.filled = True
+            self._trim(buf)
+            self._evict()
+
+    def page(self, table, chat_id, after=None, limit=50):
+        """ (rows, has_more) for the newest page or an ``after`` page, or None on a miss """
+        with self._lock:
+            buf = self._buffers.get((table, chat_id))
+            if buf is None or not buf.filled:
+                self.misses += 1
+                return None
+            rows = buf.rows
+            if after is None:
+                if len(rows) < limit and buf.has_older:
+                    self.misses += 1
+                    return None
+                page, has_more = rows[-limit:], len(rows) > limit or buf.has_older
+            else:
+                # Messages between after and the oldest buffered one may be missing
+                if buf.has_older and (not rows or after < rows[0][0]):
+                    self.misses += 1
+                    return None
+                newer = rows[bisect.bisect_right(buf.ids, after):]
+                page, has_more = newer[:limit], len(newer) > limit
+            self._buffers.move_to_end((table, chat_id))
+            self.hits += 1
+            return list(page), has_more
+
+    def discard(self, table, chat_id):
+        with self._lock:
+            buf = self._buffers.pop((table, chat_id), None)
+            if buf is not None:
+                self._bytes -= buf.size
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chats": len(self._buffers),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+recent_messages = RecentMessages()
@@ -0,0 +1,81 @@
+""" Command-line entry point for the chat server.
+
+    python run.py                          threaded Werkzeug server (development)
+    python run.py --mode eventlet          cooperative server for many idle sockets
+    python run.py --mode gevent --port 8001 --message-queue sqlite:///socketio_queue.db
+
+The async mode has to be chosen before Flask, sqlite3 and Socket.IO are
+imported, so this module monkey-patches first and imports server afterwards.
+"""
+import argparse
+import os
+import ssl
+
+MODES = ('threading', 'eventlet', 'gevent')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the chat API and Socket.IO server")
+    parser.add_argument('--mode', choices=MODES,
+                        default=os.environ.get('CHAT_APP_ASYNC_MODE') or 'threading',
+                        help="worker model (default: threading)")
+    parser.add_argument('--host', default=os.environ.get('CHAT_APP_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CHAT_APP_PORT', '8000')))
+    parser.add_argument('--cert', default='localhost+2.pem', help="TLS certificate chain")
+    parser.add_argument('--key', default='localhost+2-key.pem', help="TLS private key")
+    parser.add_argument('--no-tls', action='store_true', help="serve plain HTTP (behind a TLS proxy)")
+    parser.add_argument('--max-connections', type=int, default=20000,
+                        help="concurrent connections per eventlet worker (default: 20000)")
+    parser.add_argument('--message-queue', default=None,
+                        help="Socket.IO message queue URL for multi-process fan-out")
+    parser.add_argument('--debug', action='store_true')
+    return parser.parse_args(argv)
+
+
+def patch(mode):
+    """ Monkey-patch the standard library for the cooperative modes """
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def serve(app, socketio, args):
+    """ Run app on the web server that matches socketio's async mode """
+    mode = socketio.server.eio.async_mode
+    if mode != args.mode:
+        raise SystemExit(f"Socket.IO is running in {mode} mode; start with python run.py --mode {args.mode}")
+
+    kwargs = {'host': args.host, 'port': args.port, 'debug': args.debug, 'use_reloader': False}
+    if not args.no_tls:
+        if mode == 'threading':
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.load_cert_chain(args.cert, args.key)
+            kwargs['ssl_context'] = context
+        else:
+            kwargs['certfile'] = args.cert
+            kwargs['keyfile'] = args.key
+    if mode == 'threading':
+        kwargs['allow_unsafe_werkzeug'] = True
+    elif mode == 'eventlet':
+        kwargs['max_size'] = args.max_connections
+
+    socketio.run(app, **kwargs)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    patch(args.mode)
+    os.environ['CHAT_APP_ASYNC_MODE'] = args.mode
+    if args.message_queue is not None:
+        os.environ['CHAT_APP_MESSAGE_QUEUE'] = args.message_queue
+
+    import server
+    serve(server.app, server.socketio, args)
+
+
+if __name__ == "__main__":
+    main()
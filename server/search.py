@@ -0,0 +1,94 @@
+import html
+import re
+
+# Search text is never passed to MATCH as-is: every word becomes a quoted
+# FTS5 string, so operators and stray quotes in user input can't break the
+# query. The last word is a prefix so results appear while typing.
+WORD = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+SNIPPET_TOKENS = 12
+
+# Snippets are built with control-character markers and HTML-escaped here,
+# so message text can never smuggle markup into the highlighted result.
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+
+
+def fts_terms(text):
+    """ Turn free text into an FTS5 expression, or None if it has no words """
+    words = WORD.findall(text or '')[:MAX_TERMS]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(snippet):
+    return html.escape(snippet or '').replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>')
+
+
+def search_messages(c, user_id, text, limit, offset=0):
+    """ Rank plain messages in the user's group chats; returns (results, has_more) """
+    terms = fts_terms(text)
+    if terms is None:
+        return [], False
+    c.execute("""
+        SELECT cp.chat_id
+        FROM chat_participants cp
+        JOIN chats ch ON ch.id = cp.chat_id AND ch.type != 'private'
+        WHERE cp.user_id = ?
+    """, (user_id,))
+    chat_ids = [row[0] for row in c.fetchall()]
+    if not chat_ids:
+        return [], False
+
+    chats = ' OR '.join(f'c{chat_id}' for chat_id in chat_ids)
+    c.execute("""
+        SELECT pm.id, pm.chat_id, ch.name, pm.sender_id, pm.timestamp,
+               snippet(plainmessages_fts, 0, ?, ?, '…', ?)
+        FROM plainmessages_fts
+        JOIN plainmessages pm ON pm.id = plainmessages_fts.rowid
+        JOIN chats ch ON ch.id = pm.chat_id
+        WHERE plainmessages_fts MATCH ?
+        ORDER BY plainmessages_fts.rank
+        LIMIT ? OFFSET ?
+    """, (MARK_OPEN, MARK_CLOSE, SNIPPET_TOKENS, f'chat : ({chats}) AND content : ({terms})', limit + 1, offset))
+    rows = c.fetchall()
+    return [
+        {
+            "id":        message_id,
+            "chat_id":   chat_id,
+            "chat_name": chat_name,
+            "sender":    sender,
+            "timestamp": ts,
+            "snippet":   highlight(snippet)
+        }
+        for message_id, chat_id, chat_name, sender, ts, snippet in rows[:limit]
+    ], len(rows) > limit
+
+
+def search_dashboard(c, text, limit, offset=0):
+    """ Rank dashboard posts, title matches first; returns (results, has_more) """
+    terms = fts_terms(text)
+    if terms is None:
+        return [], False
+    c.execute("""
+        SELECT d.id, d.username, d.title, d.created_at,
+               snippet(dashboard_fts, 1, ?, ?, '…', ?)
+        FROM dashboard_fts
+        JOIN dashboard d ON d.id = dashboard_fts.rowid
+        WHERE dashboard_fts MATCH ?
+        ORDER BY bm25(dashboard_fts, 2.0, 1.0)
+        LIMIT ? OFFSET ?
+    """, (MARK_OPEN, MARK_CLOSE, SNIPPET_TOKENS, terms, limit + 1, offset))
+    rows = c.fetchall()
+    return [
+        {
+            "id":         post_id,
+            "username":   username,
+            "title":      title,
+            "created_at": created_at,
+            "snippet":    highlight(snippet)
+        }
+        for post_id, username, title, created_at, snippet in rows[:limit]
+    ], len(rows) > limit
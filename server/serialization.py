@@ -0,0 +1,200 @@
+import gzip
+import json
+import os
+import zlib
+from itertools import islice
+
+from flask import Response, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# JSON goes through orjson when it is installed (CHAT_APP_JSON=json forces
+# the standard library), with Flask's sorted keys and fallbacks for dates
+# and the like so the bytes match what jsonify produced before. Responses
+# of at least CHAT_APP_COMPRESS_MIN_BYTES are compressed with the best of
+# zstd, brotli and gzip that both sides support; 0 turns compression off.
+JSON_BACKEND = os.environ.get('CHAT_APP_JSON', 'orjson')
+COMPRESS_MIN_BYTES = int(os.environ.get('CHAT_APP_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('CHAT_APP_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('CHAT_APP_BROTLI_QUALITY', '5'))
+ZSTD_LEVEL = int(os.environ.get('CHAT_APP_ZSTD_LEVEL', '3'))
+
+# Arrays with at least this many items are sent as a chunked stream, read
+# from their iterable, encoded and compressed STREAM_CHUNK_ITEMS at a time
+STREAM_MIN_ITEMS = int(os.environ.get('CHAT_APP_STREAM_MIN_ITEMS', '1000'))
+STREAM_CHUNK_ITEMS = 256
+
+COMPRESSIBLE = {'application/json', 'application/msgpack', 'text/plain', 'text/html'}
+
+_use_orjson = orjson is not None and JSON_BACKEND == 'orjson'
+_ORJSON_OPTIONS = (
+    orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+)
+
+
+def dumps(obj):
+    """ Compact JSON as bytes, with sorted keys like Flask's provider """
+    if _use_orjson:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        obj, default=DefaultJSONProvider.default, sort_keys=True, separators=(',', ':')
+    ).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """ app.json backed by orjson, so jsonify and app.json.dumps use it unchanged """
+
+    def dumps(self, obj, **kwargs):
+        if not _use_orjson or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        if not _use_orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def available_encodings():
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def negotiate_encoding():
+    """ The client's highest-weighted encoding we support, preferring zstd > br > gzip on ties """
+    if COMPRESS_MIN_BYTES <= 0:
+        return None
+    accepted = request.accept_encodings
+    best, best_q = None, 0
+    for encoding in available_encodings():
+        q = accepted[encoding]
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_chunks(chunks, encoding):
+    """ Compress an iterable of byte chunks incrementally """
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        out = process(chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def _weaken_etag(response):
+    # The compressed bytes differ from the identity ones, so a strong
+    # validator no longer holds; If-None-Match compares weakly either way
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def stream_json(items, status=200, close=None):
+    """ A JSON array response from any iterable, such as a generator over a cursor.
+
+    Up to STREAM_MIN_ITEMS items are read first; a shorter array is sent as
+    an ordinary response, a longer one is streamed while the rest of the
+    iterable is consumed. ``close`` runs once the response is done with,
+    so a generator can keep its connection open until the last row is sent.
+    """
+    items = iter(items)
+    try:
+        head = list(islice(items, STREAM_MIN_ITEMS))
+    except BaseException:
+        if close is not None:
+            close()
+        raise
+    if len(head) < STREAM_MIN_ITEMS:
+        if close is not None:
+            close()
+        return Response(dumps(head), status=status, mimetype='application/json')
+
+    def chunks():
+        yield b'['
+        batch, first = head, True
+        while batch:
+            for start in range(0, len(batch), STREAM_CHUNK_ITEMS):
+                part = dumps(batch[start:start + STREAM_CHUNK_ITEMS])[1:-1]
+                yield part if first else b',' + part
+                first = False
+            batch = list(islice(items, STREAM_CHUNK_ITEMS))
+        yield b']'
+
+    encoding = negotiate_encoding()
+    body = chunks() if encoding is None else compress_chunks(chunks(), encoding)
+    response = Response(body, status=status, mimetype='application/json')
+    if close is not None:
+        # Also runs when the body is never iterated, unlike a finally block
+        response.call_on_close(close)
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def compress_response(response):
+    """ after_request hook: compress large bodies with the negotiated encoding """
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (
+        response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or 'Content-Encoding' in response.headers
+    ):
+        return response
+    length = response.calculate_content_length()
+    if length is None or length < COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    _weaken_etag(response)
+    return response
+
+
+def init_app(app):
+    """ Serialize with the fast JSON provider and compress responses """
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
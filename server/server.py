@@ -1,17 +1,91 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 from flask_socketio import SocketIO, join_room
-import sqlite3
-from sqlite3 import Error
-import uuid
+from sqlite3 import Error, IntegrityError
+import hashlib
+import heapq
+import json
 import os
-import ssl
+from collections import defaultdict
 from datetime import datetime, timezone
-from argon2 import PasswordHasher
+from offload import ASYNC_MODE
+from db import PoolTimeout, pool
+from broadcast import MESSAGE_QUEUE, create_client_manager
+from migrations import run_migrations
+from hashing import HashPoolSaturated, RETRY_AFTER_SECONDS, argon2_hash, argon2_verify, hash_pool
+from write_batcher import BatcherSaturated, message_writer
+from sessions import require_session, sessions
+from e2ee_codec import pack_b64
+from search import search_dashboard, search_messages
+from timetable import MAX_SLOT_MINUTES, WEEKDAYS, day_range, find_conflict, format_span, group_free_slots, slot_minutes
+from cache import ResultCache
+from serialization import init_app as init_serialization, stream_json
+from recent_messages import recent_messages
+from archive import archiver, has_segments, merge_archived
+from logs import get_logger, init_app, setup_logging
+import logs
+from metrics import (
+    FANOUT_BUCKETS, CallbackGauge, Gauge, Histogram, StatsGauges, init_app as init_metrics, metrics_response,
+)
+from chat_queries import (
+    format_messages, load_chat_summaries, load_chat_type, load_message_changes, load_message_rows,
+    load_participant_changes, mark_read,
+)
+
+setup_logging()
+log = get_logger('api')
 
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+init_app(app)
+init_metrics(app)
+init_serialization(app)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, client_manager=create_client_manager())
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Without a token, /metrics only answers scrapers on this machine
+METRICS_TOKEN = os.environ.get('CHAT_APP_METRICS_TOKEN', '')
+LOOPBACK_ADDRS = {'127.0.0.1', '::1'}
+
+SOCKET_CLIENTS = Gauge('chat_socketio_connected_clients', 'Socket.IO clients connected to this process')
+EMIT_FANOUT = Histogram('chat_socketio_emit_fanout', 'Local clients reached per room emit',
+                        ('event',), buckets=FANOUT_BUCKETS)
+
+def _local_rooms():
+    return socketio.server.manager.rooms.get('/', {})
+
+CallbackGauge('chat_socketio_rooms', 'Chat rooms with at least one local client',
+              lambda: sum(1 for room in list(_local_rooms())
+                          if isinstance(room, str) and room.startswith('chat_') and ':' not in room))
+StatsGauges('chat_db_pool', 'SQLite connection pool', pool.stats)
+StatsGauges('chat_hash_pool', 'Argon2 hashing pool', hash_pool.stats)
+StatsGauges('chat_write_batcher', 'Message write batcher', message_writer.stats)
+StatsGauges('chat_session_cache', 'Session token cache', sessions.stats)
+StatsGauges('chat_log_queue', 'Structured log queue', logs.stats)
+StatsGauges('chat_recent_messages', 'Recent message buffers', recent_messages.stats)
+StatsGauges('chat_archiver', 'Message archiver', archiver.stats)
+
+# Other processes' writes never reach this process's buffers
+if MESSAGE_QUEUE:
+    recent_messages.per_chat = 0
+
+def emit_to_room(event, data, room):
+    """ Emit to a room and record how many clients on this process it reaches """
+    EMIT_FANOUT.observe(len(_local_rooms().get(room, ())), event)
+    socketio.emit(event, data, room=room)
+
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return jsonify({"error": "Not authenticated"}), 401
+    elif request.remote_addr not in LOOPBACK_ADDRS:
+        return jsonify({"error": "Set CHAT_APP_METRICS_TOKEN to scrape metrics remotely"}), 403
+    return metrics_response()
 
 @app.after_request
 def add_security_headers(response):
@@ -23,122 +97,23 @@ def add_security_headers(response):
 def ping():
     return jsonify(msg="pong")
 
-ph = PasswordHasher(
-    time_cost=3,
-    memory_cost=65536,
-    parallelism=4,
-    salt_len=16,
-    hash_len=32,
-)
-
 def create_connection():
-    """ Create a database connection to the SQLite database """
+    """ Check out a pooled connection to the SQLite database; close() returns it.
+
+    PoolTimeout propagates to the errorhandler below as a 503.
+    """
     conn = None
     try:
-        conn = sqlite3.connect('chat_app.db')
+        conn = pool.acquire()
         return conn
-    except Error as e:
-        print(e)
+    except PoolTimeout:
+        raise
+    except Error:
+        log.exception("Could not acquire a database connection")
     return conn
 
-def create_tables():
-    """ Create the necessary tables if they don't exist """
-    conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    salt TEXT NOT NULL, 
-                    password TEXT NOT NULL,
-                    public_key TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS chats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    type TEXT NOT NULL,
-                    name TEXT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''') #id, 그룹또는 개인 구분, 채팅이름, 생성일
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS chat_participants (
-                      chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
-                      user_id TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
-                      PRIMARY KEY (chat_id, user_id)
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS plainmessages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
-                    sender_id TEXT NOT NULL REFERENCES users(username),
-                    content TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS e2eemessages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
-                    sender_id TEXT NOT NULL REFERENCES users(username),
-                    iv TEXT NOT NULL,
-                    ct TEXT NOT NULL,
-                    tag TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS dashboard (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS timetable (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL,
-                    day TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    duration INTEGER NOT NULL,
-                    content TEXT NOT NULL
-                )
-            ''')
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id               INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id         INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
-                    participant_name TEXT    NOT NULL,
-                    task_name        TEXT    NOT NULL,
-                    deadline         DATE    NOT NULL,
-                    status           TEXT    NOT NULL DEFAULT 'In Progess',
-                    created_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(group_id, task_name)
-                )
-            ''')
-            conn.commit()
-            print("Database tables created successfully")
-        except Error as e:
-            print(e)
-        finally:
-            conn.close()
-    else:
-        print("Error: Could not create database connection")
-
-create_tables()
+run_migrations()
+archiver.start()
 
 @app.route("/api/home", methods=['GET'])
 def return_home():
@@ -147,9 +122,16 @@ def return_home():
         'people': ["David", "Choi"]
     })
 
+def server_busy():
+    return jsonify({"error": "Server busy, please retry"}), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(e):
+    log.warning("Database pool exhausted")
+    return server_busy()
+
 @app.route("/api/login", methods=['POST'])
 def login():
-    print("login successful")
     data = request.json
     username = data.get('username')
     hash_password = data.get('password')
@@ -158,36 +140,41 @@ def login():
         return jsonify({"error": "Missing username or password"}), 400
     
     conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            c.execute("SELECT username, salt, password FROM users WHERE username = ?", (username,))
-            user = c.fetchone()
-            
-            if not user:
-                return jsonify({"error": "Invalid username or password"}), 401
+    if conn is None:
+        return jsonify({"error": "Server error"}), 500
+    try:
+        c = conn.cursor()
+        c.execute("SELECT id, salt, password FROM users WHERE username = ?", (username,))
+        user = c.fetchone()
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
 
-            token = str(uuid.uuid4())
-            user_db, salt, hash = user
+    if not user:
+        return jsonify({"error": "Invalid username or password"}), 401
 
-            try:
-                ph.verify(hash, hash_password + salt)
-                return jsonify({
-                    "success": True,
-                    "token": token,
-                    "username": username,
-                    "message": "Successfully signed in"
-                })
-            except:
-                return jsonify({"error": "Invalid username or password"}), 401
-            
-        except Error as e:
-            print(e)
-            return jsonify({"error": "Database error"}), 500
-        finally:
-            conn.close()
-    
-    return jsonify({"error": "Server error"}), 500
+    # Hash outside the connection so Argon2 never holds a pooled connection
+    user_id, salt, hash = user
+    try:
+        verified = argon2_verify(hash, hash_password + salt)
+    except HashPoolSaturated:
+        return server_busy()
+    if not verified:
+        return jsonify({"error": "Invalid username or password"}), 401
+
+    try:
+        token = sessions.create(user_id, username)
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    return jsonify({
+        "success": True,
+        "token": token,
+        "username": username,
+        "message": "Successfully signed in"
+    })
 
 @app.route("/api/signup", methods=['POST'])
 def signup():
@@ -198,298 +185,705 @@ def signup():
     
     if not username or not first_hash:
         return jsonify({"error": "Missing username or password"}), 400
+    if not public_key:
+        return jsonify({"error": "Missing publicKey"}), 400
     
     conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            c.execute("SELECT username FROM users WHERE username = ?", (username,))
-            if c.fetchone():
-                return jsonify({"error" : "Username already exists"}), 409
-            
-            salt = os.urandom(16).hex()
-            second_hash = ph.hash(first_hash + salt)
+    if conn is None:
+        return jsonify({"error": "Server error"}), 500
+    try:
+        c = conn.cursor()
+        c.execute("SELECT username FROM users WHERE username = ?", (username,))
+        exists = c.fetchone() is not None
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
+    if exists:
+        return jsonify({"error" : "Username already exists"}), 409
 
-            c.execute(
-                "INSERT INTO users (username, salt, password, public_key) VALUES (?, ?, ?, ?)",
-                (username, salt, second_hash, public_key)
-            )
-            conn.commit()
+    salt = os.urandom(16).hex()
+    try:
+        second_hash = argon2_hash(first_hash + salt)
+    except HashPoolSaturated:
+        return server_busy()
 
-            return jsonify({
-                "success": True,
-                "username": username,
-                "message": "User registered successfully"
-            }), 201
-        except Error as e:
-            print(e)
-            return jsonify({"error": "Database error"}), 500
-        finally:
-            conn.close()
-    return jsonify({"error": "Server error"}), 500
+    conn = create_connection()
+    if conn is None:
+        return jsonify({"error": "Server error"}), 500
+    try:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO users (username, salt, password, public_key) VALUES (?, ?, ?, ?)",
+            (username, salt, second_hash, public_key)
+        )
+        user_id = c.lastrowid
+        conn.commit()
+        token = sessions.create(user_id, username)
+
+        return jsonify({
+            "success": True,
+            "token": token,
+            "username": username,
+            "message": "User registered successfully"
+        }), 201
+    except IntegrityError as e:
+        conn.rollback()
+        # Only the unique username is expected to fail once inputs are checked
+        if 'users.username' in str(e):
+            return jsonify({"error" : "Username already exists"}), 409
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    except Error:
+        log.exception("Database error")
+        conn.rollback()
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
+
+@app.route("/api/logout", methods=['POST'])
+@require_session
+def logout():
+    try:
+        sessions.revoke(g.session_token)
+    except PoolTimeout:
+        return server_busy()
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    return jsonify(success=True), 200
 
 @app.route("/api/getchats", methods=['GET'])
+@require_session
 def getchats():
-    username = request.args.get('username')
-    if not username:
-        return jsonify({"error": "Missing username"}), 400
     conn = create_connection()
     try:
         c = conn.cursor()
-        c.execute("SELECT id FROM users WHERE username = ?", (username,))
-        row = c.fetchone()
-        if not row:
-            return jsonify({"error": "User not found"}), 404
-        user_id = row[0]
+        # stream_json closes the connection once the last chat is sent
+        return stream_json(load_chat_summaries(c, g.user_id, g.username), close=conn.close)
 
-        c.execute("""
-            SELECT c.id, c.name, c.type
-            FROM chats c
-            JOIN chat_participants cp ON c.id = cp.chat_id
-            WHERE cp.user_id = ?
-            ORDER BY c.created_at DESC
-        """, (user_id,))
-        chats = c.fetchall()
-
-        result = []
-        for chat_id, name, chat_type in chats:
-            c.execute("""
-                SELECT u.username
-                FROM users u
-                JOIN chat_participants cp ON u.id = cp.user_id
-                WHERE cp.chat_id = ?
-            """, (chat_id,))
-            participant_usernames = [r[0] for r in c.fetchall()]
-
-            msgs = []
-            if chat_type == 'private':
-                c.execute("""
-                  SELECT u.username, em.iv, em.ct, em.tag, em.timestamp
-                  FROM e2eemessages em
-                  JOIN users u ON em.sender_id = u.username
-                  WHERE em.chat_id = ?
-                  ORDER BY em.timestamp ASC
-                """, (chat_id,))
-                for sender_name, iv, ct, tag, ts in c.fetchall():
-                    print(sender_name, iv, ct, tag, ts)
-                    msgs.append({
-                        "sender":    sender_name,
-                        "iv":        iv,
-                        "ct":        ct,
-                        "tag":       tag,
-                        "timestamp": ts
-                    })
-                print(msgs)
-            else:
-                c.execute("""
-                  SELECT u.username, pm.content, pm.timestamp
-                  FROM plainmessages pm
-                  JOIN users u ON pm.sender_id = u.username
-                  WHERE pm.chat_id = ?
-                  ORDER BY pm.timestamp ASC
-                """, (chat_id,))
-                for sender_name, content, ts in c.fetchall():
-                    msgs.append({
-                        "sender":    sender_name,
-                        "content":   content,
-                        "timestamp": ts
-                    })
-
-            display_name = name
-            if chat_type == "private":
-                others = [u for u in participant_usernames if u != username]
-                if others:
-                    display_name = others[0]
-            result.append({
-                "chat_id":      chat_id,
-                "name":         display_name,
-                "type":         chat_type,
-                "participants": participant_usernames,
-                "messages":     msgs
-            })
-        
-        return jsonify(result), 200
+    except Error:
+        conn.close()
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+
+
+MESSAGE_PAGE_DEFAULT = 50
+MESSAGE_PAGE_MAX = 200
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+def wants_msgpack():
+    """ True when the caller asked for MessagePack with raw E2EE payloads """
+    if request.args.get('format') == 'msgpack':
+        return True
+    return request.accept_mimetypes.best == MSGPACK_MIMETYPE
+
+def respond(body, binary, status=200):
+    if not binary:
+        return jsonify(body), status
+    return Response(msgpack.packb(body, use_bin_type=True), status=status, mimetype=MSGPACK_MIMETYPE)
+
+@app.route("/api/getmessages", methods=['GET'])
+@require_session
+def getmessages():
+    chat_id = request.args.get('chatId', type=int)
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', default=MESSAGE_PAGE_DEFAULT, type=int)
+    if not chat_id:
+        return jsonify({"error": "Missing chatId"}), 400
+    if before is not None and after is not None:
+        return jsonify({"error": "Use either before or after, not both"}), 400
+    limit = max(1, min(limit, MESSAGE_PAGE_MAX))
+    binary = wants_msgpack()
+    if binary and msgpack is None:
+        return jsonify({"error": "MessagePack is not available"}), 406
+
+    conn = create_connection()
+    try:
+        c = conn.cursor()
+        chat_type = load_chat_type(c, chat_id, g.user_id)
+        if chat_type is None:
+            return jsonify({"error": "Chat not found"}), 404
+
+        table = "e2eemessages" if chat_type == 'private' else "plainmessages"
+        page = None
+        if before is None:
+            page = recent_messages.page(table, chat_id, after, limit)
+            if page is None and after is None and limit <= recent_messages.per_chat:
+                recent_messages.reserve(table, chat_id)
+                rows, has_older = load_message_rows(c, chat_id, chat_type, limit=recent_messages.per_chat)
+                # Archived history counts as older rows the buffer can't answer for
+                recent_messages.fill(table, chat_id, rows, has_older or has_segments(c, table))
+                page = recent_messages.page(table, chat_id, None, limit)
+        if page is None:
+            rows, has_more = load_message_rows(c, chat_id, chat_type, before, after, limit)
+            page = merge_archived(c, table, chat_id, before, after, limit, rows, has_more)
+        rows, has_more = page
+        messages = format_messages(rows, chat_type, binary)
+        return respond({
+            "chat_id":  chat_id,
+            "type":     chat_type,
+            "messages": messages,
+            "has_more": has_more,
+            "before":   messages[0]["id"] if messages else before,
+            "after":    messages[-1]["id"] if messages else after
+        }, binary)
+
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
+
+
+@app.route("/api/markread", methods=['POST'])
+@require_session
+def markread():
+    data = request.get_json(silent=True) or {}
+    chat_id = data.get('chatId')
+    message_id = data.get('messageId')
+    if not chat_id:
+        return jsonify({"error": "Missing chatId"}), 400
+    if message_id is not None and (isinstance(message_id, bool) or not isinstance(message_id, int)):
+        return jsonify({"error": "messageId must be an integer"}), 400
+
+    conn = create_connection()
+    try:
+        c = conn.cursor()
+        chat_type = load_chat_type(c, chat_id, g.user_id)
+        if chat_type is None:
+            return jsonify({"error": "Chat not found"}), 404
+
+        row = mark_read(c, g.user_id, chat_id, chat_type, message_id)
+        conn.commit()
+        if row is None:
+            return jsonify({"error": "Chat not found"}), 404
+        last_read_id, unread = row
+        return jsonify({"chat_id": chat_id, "last_read_id": last_read_id, "unread": unread}), 200
+
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
+
+
+SYNC_LIMIT_DEFAULT = 500
+SYNC_LIMIT_MAX = 2000
+
+def _watermark(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(value)
+    return value
 
-    except Error as e:
-        print("DB error in getchats:", e)
+@app.route("/api/sync", methods=['POST'])
+@require_session
+def sync():
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify(error="Invalid JSON"), 400
+    try:
+        plain_after = _watermark(data.get('plain'))
+        e2ee_after = _watermark(data.get('e2ee'))
+        events_after = _watermark(data.get('events'))
+        chat_marks = {
+            str(int(chat_id)): _watermark(last_id)
+            for chat_id, last_id in (data.get('chats') or {}).items()
+        }
+        limit = int(data.get('limit', SYNC_LIMIT_DEFAULT))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify(error="Watermarks must be non-negative integers"), 400
+    limit = max(1, min(limit, SYNC_LIMIT_MAX))
+    binary = wants_msgpack()
+    if binary and msgpack is None:
+        return jsonify({"error": "MessagePack is not available"}), 406
+
+    conn = create_connection()
+    try:
+        c = conn.cursor()
+        plain, plain_mark, plain_more = load_message_changes(
+            c, g.user_id, 'group', plain_after, chat_marks, limit)
+        e2ee, e2ee_mark, e2ee_more = load_message_changes(
+            c, g.user_id, 'private', e2ee_after, chat_marks, limit, binary)
+
+        events, new_chats = [], []
+        events_mark, events_more = events_after, False
+        if events_after is not None:
+            events, events_mark, events_more = load_participant_changes(
+                c, g.user_id, events_after, limit)
+            joined = {
+                e["chat_id"] for e in events
+                if e["username"] == g.username and e["event"] == 'join'
+            }
+            if joined:
+                new_chats = [
+                    chat for chat in load_chat_summaries(c, g.user_id, g.username)
+                    if chat["chat_id"] in joined
+                ]
+
+        return respond({
+            "chats":        new_chats,
+            "participants": events,
+            "plain":        plain,
+            "e2ee":         e2ee,
+            "watermarks": {
+                "plain":  plain_mark if plain_after is not None else None,
+                "e2ee":   e2ee_mark if e2ee_after is not None else None,
+                "events": events_mark
+            },
+            "has_more": plain_more or e2ee_more or events_more
+        }, binary)
+
+    except Error:
+        log.exception("Database error")
         return jsonify({"error": "Database error"}), 500
     finally:
         conn.close()
 
 
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_OFFSET_MAX = 1000
+
+@app.route("/api/search", methods=['GET'])
+@require_session
+def search():
+    text = request.args.get('q', '').strip()
+    scope = request.args.get('type', 'messages')
+    limit = request.args.get('limit', default=SEARCH_PAGE_DEFAULT, type=int)
+    offset = request.args.get('offset', default=0, type=int)
+    if not text:
+        return jsonify({"error": "Missing q"}), 400
+    if scope not in ('messages', 'dashboard'):
+        return jsonify({"error": "type must be messages or dashboard"}), 400
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    offset = max(0, min(offset, SEARCH_OFFSET_MAX))
+
+    conn = create_connection()
+    try:
+        c = conn.cursor()
+        if scope == 'messages':
+            results, has_more = search_messages(c, g.user_id, text, limit, offset)
+        else:
+            results, has_more = search_dashboard(c, text, limit, offset)
+        return jsonify({
+            "q":           text,
+            "type":        scope,
+            "results":     results,
+            "has_more":    has_more,
+            "next_offset": offset + len(results) if has_more else None
+        }), 200
+
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
+
+
+ADDCHATS_MAX_CHATS = 500
+ADDCHATS_MAX_PARTICIPANTS = 1000
+
+def _chat_spec(item):
+    """ (name, type, usernames) from one addchats entry, or None if fields are missing """
+    if not isinstance(item, dict):
+        return None
+    name = item.get('chatName')
+    chat_type = item.get('chatType')
+    usernames = item.get('usernames')
+    if not name or not chat_type or not usernames or not isinstance(usernames, list):
+        return None
+    # Repeated names would collide on the participants primary key
+    return name, chat_type, list(dict.fromkeys(str(u) for u in usernames))
+
+def create_chats(c, specs):
+    """ Create each valid chat with its participants; returns a result dict per spec.
+
+    All usernames are resolved in one query and each chat's participants
+    are inserted with one executemany. The caller commits.
+    """
+    wanted = sorted({u for spec in specs if spec for u in spec[2]})
+    c.execute(
+        "SELECT username, id FROM users WHERE username IN (SELECT value FROM json_each(?))",
+        (json.dumps(wanted),)
+    )
+    user_ids = dict(c.fetchall())
+
+    results = []
+    for index, spec in enumerate(specs):
+        if spec is None:
+            results.append({"index": index, "success": False, "error": "Missing required fields"})
+            continue
+        name, chat_type, usernames = spec
+        if len(usernames) > ADDCHATS_MAX_PARTICIPANTS:
+            results.append({"index": index, "success": False, "error": "Too many participants"})
+            continue
+        missing = [u for u in usernames if u not in user_ids]
+        if missing:
+            results.append({"index": index, "success": False, "error": "User not found", "missing": missing})
+            continue
+        c.execute("INSERT INTO chats (name, type) VALUES (?, ?)", (name, chat_type))
+        chat_id = c.lastrowid
+        c.executemany(
+            "INSERT INTO chat_participants (chat_id, user_id) VALUES (?, ?)",
+            [(chat_id, user_ids[u]) for u in usernames]
+        )
+        results.append({"index": index, "success": True, "chat_id": chat_id})
+    return results
+
 @app.route("/api/addchats", methods=['POST'])
+@require_session
 def add_chats():
-    data = request.json
-    chatName = data.get('chatName')
-    chatType = data.get('chatType')
-    usernames = data.get('usernames')
+    """ Create one chat ({chatName, chatType, usernames}) or many ({chats: [...]}) """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON"}), 400
+    bulk = 'chats' in data
+    if bulk:
+        items = data.get('chats')
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "chats must be a non-empty list"}), 400
+        if len(items) > ADDCHATS_MAX_CHATS:
+            return jsonify({"error": f"At most {ADDCHATS_MAX_CHATS} chats per request"}), 400
+        specs = [_chat_spec(item) for item in items]
+    else:
+        specs = [_chat_spec(data)]
+        if specs[0] is None:
+            return jsonify({"error": "Missing required fields"}), 400
 
-    if not chatName or not chatType or not usernames:
-        return jsonify({"error": "Missing required fields"}), 400
-    
     conn = create_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            c.execute("INSERT INTO chats (name, type) VALUES (?, ?)", (chatName, chatType))
-            chat_id = c.lastrowid
-
-            for username in usernames:
-                c.execute("SELECT id FROM users WHERE username = ?", (username,))
-                row = c.fetchone()
-                if not row:
-                    conn.rollback()
-                    return jsonify({"error": "User not found"}), 404
-                user_id = row[0]
-                c.execute("INSERT INTO chat_participants (chat_id, user_id) VALUES (?, ?)", (chat_id, user_id))
+            results = create_chats(c, specs)
             conn.commit()
-
-            return jsonify({
-                "success": True,
-                "message": "Chat created successfully"
-            }), 201
-                
-        except Error as e:
-            print(e)
+        except Error:
+            log.exception("Database error")
             conn.rollback()
             return jsonify({"error": "Database error"}), 500
         finally:
             conn.close()
 
+        if bulk:
+            return jsonify({
+                "success": all(r["success"] for r in results),
+                "created": sum(1 for r in results if r["success"]),
+                "results": results
+            }), 200
+
+        result = results[0]
+        if not result["success"]:
+            status = 404 if result["error"] == "User not found" else 400
+            return jsonify({"error": result["error"]}), status
+        return jsonify({
+            "success": True,
+            "message": "Chat created successfully",
+            "chat_id": result["chat_id"]
+        }), 201
+
     return jsonify({"error": "Server error"}), 500
 
+@socketio.on('connect')
+def on_connect(auth=None):
+    SOCKET_CLIENTS.inc()
+
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    SOCKET_CLIENTS.dec()
+
 @socketio.on('join')
 def on_join(data):
-    join_room(f"chat_{data['chat_id']}")
+    # Everyone gets the chat's plain messages and task events from chat_{id};
+    # E2EE messages go to chat_{id}:bin as one binary frame for clients that
+    # join with binary=True, and to chat_{id}:json as base64 fields otherwise
+    room = f"chat_{data['chat_id']}"
+    join_room(room)
+    join_room(f"{room}:bin" if data.get('binary') else f"{room}:json")
+
+def post_plain_message(chat_id, username, message):
+    """ Store a plain message through the write batcher and push it to the chat room """
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    message_id = message_writer.write(
+        "INSERT INTO plainmessages (chat_id, sender_id, content, timestamp) VALUES (?, ?, ?, ?)",
+        (chat_id, username, message, timestamp),
+        lambda message_id: recent_messages.append(
+            "plainmessages", int(chat_id), (message_id, username, message, timestamp))
+    )
+    emit_plain_message(chat_id, message_id, username, message, timestamp)
+    return message_id
+
+def emit_plain_message(chat_id, message_id, username, message, timestamp):
+    emit_to_room('new_message', {
+        'id': message_id,
+        'chat_id': chat_id,
+        'sender': username,
+        'content': message,
+        'timestamp': timestamp
+    }, f"chat_{chat_id}")
+
+def check_chat_member(chat_id):
+    """ An error response unless chat_id is a chat the caller participates in, else None """
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return jsonify({"error": "chatId must be an integer"}), 400
+    conn = create_connection()
+    try:
+        if load_chat_type(conn.cursor(), chat_id, g.user_id) is None:
+            return jsonify({"error": "Chat not found"}), 404
+    finally:
+        conn.close()
+    return None
 
 @app.route("/api/sendmessageplain", methods=['POST'])
+@require_session
 def sendmessageplain():
     data = request.json
     message = data.get('message')
     chat_id = data.get('chatId')
-    username = data.get('username')
+    username = g.username
 
     if not message or not chat_id or not username:
         return jsonify({"error": "Missing required fields"}), 400
-    
-    conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            c.execute("INSERT INTO plainmessages (chat_id, sender_id, content) VALUES (?, ?, ?)", (chat_id, username, message))
-            conn.commit()
-            room = f"chat_{chat_id}"
-            socketio.emit('new_message', {
-                'chat_id': chat_id,
-                'sender': username,
-                'content': message,
-                'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-            }, room=room)
-            return jsonify({"success": True}), 200
-        except Error as e:
-            print(e)
-            conn.rollback()
-            return jsonify({"error": "Database error"}), 500
-        finally:
-            conn.close()
-    
-    return jsonify({"error": "Server error"}), 500
+
+    try:
+        # Foreign keys would only reject a bad chatId inside the batch
+        error = check_chat_member(chat_id)
+        if error is not None:
+            return error
+        post_plain_message(chat_id, username, message)
+    except BatcherSaturated:
+        return server_busy()
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    return jsonify({"success": True}), 200
 
 @app.route("/api/sendmessagee2ee", methods=['POST'])
+@require_session
 def sendmessagee2ee():
     data = request.json
     chat_id = data.get('chatId')
     iv = data.get('iv')
     ct = data.get('ct')
     tag = data.get('tag')
-    username = data.get('username')
-    print(chat_id, iv, ct, tag, username)
+    username = g.username
     if not chat_id or not iv or not ct or not tag or not username:
         return jsonify({"error": "Missing required fields"}), 400
-    conn = create_connection()
-    if conn is not None:
+    try:
+        payload = pack_b64(iv, ct, tag)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        error = check_chat_member(chat_id)
+        if error is not None:
+            return error
+        message_id = message_writer.write(
+            "INSERT INTO e2eemessages (chat_id, sender_id, payload, timestamp) VALUES (?, ?, ?, ?)",
+            (chat_id, username, payload, timestamp),
+            lambda message_id: recent_messages.append(
+                "e2eemessages", int(chat_id), (message_id, username, payload, timestamp))
+        )
+    except BatcherSaturated:
+        return server_busy()
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+
+    room = f"chat_{chat_id}"
+    emit_to_room('new_message', {
+        'id': message_id,
+        'chat_id': chat_id,
+        'sender': username,
+        'iv': iv,
+        'ct': ct,
+        'tag': tag,
+        'timestamp': timestamp
+    }, f"{room}:json")
+    emit_to_room('new_message', {
+        'id': message_id,
+        'chat_id': chat_id,
+        'sender': username,
+        'payload': payload,
+        'timestamp': timestamp
+    }, f"{room}:bin")
+    return jsonify({"success": True}), 200
+
+PUBLIC_KEYS_MAX = 200
+
+# Public keys are written once at signup and never change, so entries only
+# age out of the LRU; validators are derived from the keys themselves and
+# agree across worker processes.
+public_key_cache = ResultCache(size=10000, ttl=3600)
+StatsGauges('chat_public_key_cache', 'Public key cache', public_key_cache.stats)
+
+def key_etag(pairs):
+    """ ETag over sorted (username, public_key) pairs """
+    digest = hashlib.sha256()
+    for username, public_key in pairs:
+        digest.update(f"{username}\0{public_key}\n".encode())
+    return f"pk-{digest.hexdigest()[:32]}"
+
+def load_public_keys(usernames):
+    """ Map username -> public key for the known users, reading the cache first """
+    keys = {}
+    misses = []
+    for username in usernames:
+        public_key = public_key_cache.get(username)
+        if public_key is None:
+            misses.append(username)
+        else:
+            keys[username] = public_key
+    if misses:
+        conn = create_connection()
         try:
             c = conn.cursor()
-            c.execute("INSERT INTO e2eemessages (chat_id, sender_id, iv, ct, tag) VALUES (?, ?, ?, ?, ?)", (chat_id, username, iv, ct, tag))
-            conn.commit()
-
-            room = f"chat_{chat_id}"
-            
-            socketio.emit('new_message', {
-                'chat_id': chat_id,
-                'sender': username,
-                'iv': iv,
-                'ct': ct,
-                'tag': tag,
-                'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-            }, room=room)
-            return jsonify({"success": True}), 200
-        except Error as e:
-            print(e)
-            conn.rollback()
-            return jsonify({"error": "Database error"}), 500
+            c.execute(
+                "SELECT username, public_key FROM users WHERE username IN (SELECT value FROM json_each(?))",
+                (json.dumps(misses),)
+            )
+            for username, public_key in c.fetchall():
+                public_key_cache.set(username, public_key)
+                keys[username] = public_key
         finally:
             conn.close()
+    return keys
 
-    return jsonify({"error": "Server error"}), 500
+def key_response(body, etag):
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route("/api/getPublicKey", methods=['GET'])
+@require_session
 def getPublicKey():
     username = request.args.get('username')
-    print(username)
     if not username:
         return jsonify({"error": "Missing username"}), 400
-    
-    conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            c.execute("SELECT public_key FROM users WHERE username = ?", (username,))
-            row = c.fetchone()
-            if not row:
-                return jsonify({"error": "User not found"}), 404
-            public_key = row[0]
-            return jsonify({"publicKey": public_key}), 200
-        except Error as e:
-            print(e)
-            return jsonify({"error": "Database error"}), 500
-        finally:
-            conn.close()
 
-    return jsonify({"error": "Server error"}), 500
+    try:
+        keys = load_public_keys([username])
+    except PoolTimeout:
+        return server_busy()
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    if username not in keys:
+        return jsonify({"error": "User not found"}), 404
+    return key_response({"publicKey": keys[username]}, key_etag([(username, keys[username])]))
+
+@app.route("/api/getPublicKeys", methods=['GET'])
+@require_session
+def getPublicKeys():
+    """ Public keys for ?username=a&username=b..., as {keys: {...}, missing: [...]} """
+    usernames = sorted(set(filter(None, request.args.getlist('username'))))
+    if not usernames:
+        return jsonify({"error": "Missing username"}), 400
+    if len(usernames) > PUBLIC_KEYS_MAX:
+        return jsonify({"error": f"At most {PUBLIC_KEYS_MAX} usernames per request"}), 400
+
+    try:
+        keys = load_public_keys(usernames)
+    except PoolTimeout:
+        return server_busy()
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    missing = [u for u in usernames if u not in keys]
+    return key_response(
+        {"keys": keys, "missing": missing},
+        key_etag(sorted(keys.items()) + [(u, '') for u in missing])
+    )
+
+DASHBOARD_PAGE_DEFAULT = 50
+DASHBOARD_PAGE_MAX = 200
+
+# Pages are keyed by the newest post id, so a post added through any worker
+# changes the key (and the ETag) without cross-process invalidation.
+dashboard_cache = ResultCache(size=256, ttl=300)
+StatsGauges('chat_dashboard_cache', 'Dashboard page cache', dashboard_cache.stats)
 
 @app.route("/api/getdashboard", methods=['GET'])
+@require_session
 def getdashboard():
-    print("reached here")
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', default=DASHBOARD_PAGE_DEFAULT, type=int)
+    limit = max(1, min(limit, DASHBOARD_PAGE_MAX))
+
     conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            c.execute("SELECT * FROM dashboard")
+    try:
+        c = conn.cursor()
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM dashboard")
+        head = c.fetchone()[0]
+        etag = f"dashboard-{head}-{before or 0}-{limit}"
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        key = (head, before, limit)
+        page = dashboard_cache.get(key)
+        if page is None:
+            if before is None:
+                c.execute("""
+                    SELECT id, username, title, content, created_at
+                    FROM dashboard
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                """, (limit + 1,))
+            else:
+                c.execute("""
+                    SELECT id, username, title, content, created_at
+                    FROM dashboard
+                    WHERE (created_at, id) < (SELECT created_at, id FROM dashboard WHERE id = ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                """, (before, limit + 1))
             rows = c.fetchall()
-            result = []
-            for dashboard in rows:
-                result.append({
-                    "id": dashboard[0],
-                    "username": dashboard[1],
-                    "title": dashboard[2],
-                    "content": dashboard[3],
-                    "created_at": dashboard[4]
-                })
-            print(result)
-            return jsonify(result), 200
-        except Error as e:
-            print(e)
-            return jsonify({"error": "Database error"}), 500
-        finally:
-            conn.close()
-    
-    return jsonify({"error": "Server error"}), 500
+            posts = [
+                {
+                    "id":         post_id,
+                    "username":   username,
+                    "title":      title,
+                    "content":    content,
+                    "created_at": created_at
+                }
+                for post_id, username, title, content, created_at in rows[:limit]
+            ]
+            next_before = posts[-1]["id"] if len(rows) > limit else None
+            page = (app.json.dumps(posts), next_before)
+            dashboard_cache.set(key, page)
+
+        body, next_before = page
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        if next_before is not None:
+            response.headers['X-Next-Before'] = str(next_before)
+        return response
+
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
 
 @app.route("/api/addDashboard", methods=['POST'])
+@require_session
 def addDashboard():
     data = request.json
-    username = data.get('username')
+    username = g.username
     title = data.get('title')
     content = data.get('content')
 
@@ -502,9 +896,10 @@ def addDashboard():
             c = conn.cursor()
             c.execute("INSERT INTO dashboard (username, title, content) VALUES (?, ?, ?)", (username, title, content))
             conn.commit()
+            dashboard_cache.clear()
             return jsonify({"success": True, "message": "Dashboard added successfully"}), 201
-        except Error as e:
-            print(e)
+        except Error:
+            log.exception("Database error")
             conn.rollback()
             return jsonify({"error": "Database error"}), 500
         finally:
@@ -512,32 +907,49 @@ def addDashboard():
     
     return jsonify({"error": "Server error"}), 500
 
+def timetable_dict(row):
+    return {
+        "id": row[0],
+        "username": row[1],
+        "day": row[2],
+        "time": row[3],
+        "duration": row[4],
+        "content": row[5],
+        "start_minute": row[6],
+        "end_minute": row[7]
+    }
+
 @app.route("/api/gettimetable", methods=['GET'])
+@require_session
 def gettimetable():
-    username = request.args.get('username')
-    if not username:
-        return jsonify({"error": "Missing username"}), 400
-    
+    """ The user's slots in week order; ?day=Tuesday&from=09:00&to=12:00 keeps those overlapping the window """
+    username = g.username
+    day = request.args.get('day')
+    try:
+        window = day_range(day, request.args.get('from'), request.args.get('to')) if day else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     conn = create_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            c.execute("SELECT * FROM timetable WHERE username = ?", (username,))
-            rows = c.fetchall()
-            result = []
-            for timetable in rows:
-                result.append({
-                    "id": timetable[0],
-                    "username": timetable[1],
-                    "day": timetable[2],
-                    "time": timetable[3],
-                    "duration": timetable[4],
-                    "content": timetable[5]
-                })
-            print(result)
-            return jsonify(result), 200
-        except Error as e:
-            print(e)
+            columns = "id, username, day, time, duration, content, start_minute, end_minute"
+            if window is None:
+                c.execute(f"""
+                    SELECT {columns} FROM timetable WHERE username = ?
+                    ORDER BY start_minute IS NULL, start_minute, id
+                """, (username,))
+            else:
+                # Slots are at most MAX_SLOT_MINUTES long, which bounds the index range
+                c.execute(f"""
+                    SELECT {columns} FROM timetable
+                    WHERE username = ? AND start_minute > ? AND start_minute < ? AND end_minute > ?
+                    ORDER BY start_minute, id
+                """, (username, window[0] - MAX_SLOT_MINUTES, window[1], window[0]))
+            return jsonify([timetable_dict(row) for row in c.fetchall()]), 200
+        except Error:
+            log.exception("Database error")
             return jsonify({"error": "Database error"}), 500
         finally:
             conn.close()
@@ -545,10 +957,10 @@ def gettimetable():
     return jsonify({"error": "Server error"}), 500
 
 @app.route("/api/addtimetable", methods=['POST'])
+@require_session
 def addtimetable():
-    print("reached here")
     data = request.json
-    username = data.get('username')
+    username = g.username
     day = data.get('day')
     time = data.get('time')
     duration = data.get('duration')
@@ -556,16 +968,33 @@ def addtimetable():
 
     if not username or not day or not time or not duration or not content:
         return jsonify({"error": "Missing required fields"}), 400
-        
+    try:
+        start, end = slot_minutes(day, time, duration)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     conn = create_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            c.execute("INSERT INTO timetable (username, day, time, duration, content) VALUES (?, ?, ?, ?, ?)", (username, day, time, duration, content))
+            # Check and insert under the write lock so two requests can't both pass the check
+            c.execute("BEGIN IMMEDIATE")
+            conflict = find_conflict(c, username, start, end)
+            if conflict is not None:
+                conn.rollback()
+                conflict_day, conflict_start, conflict_end = format_span(conflict[1], conflict[2])
+                return jsonify({
+                    "error": f"Overlaps an existing slot on {conflict_day} {conflict_start}-{conflict_end}",
+                    "conflict_id": conflict[0]
+                }), 409
+            c.execute(
+                "INSERT INTO timetable (username, day, time, duration, content, start_minute, end_minute) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (username, day, time, duration, content, start, end)
+            )
             conn.commit()
             return jsonify({"success": True, "message": "Timetable added successfully"}), 201
-        except Error as e:
-            print(e)
+        except Error:
+            log.exception("Database error")
             conn.rollback()
             return jsonify({"error": "Database error"}), 500
         finally:
@@ -574,15 +1003,11 @@ def addtimetable():
     return jsonify({"error": "Server error"}), 500
 
 @app.route("/api/deletetimetable", methods=['DELETE'])
+@require_session
 def deletetimetable():
-    print("reached here")
     data = request.json
-    print("reached here 2")
     id = data.get('id')
-    username = data.get('username')
-    print(1)
-    print(id, username)
-    print(2)
+    username = g.username
     if not id or not username:
         return jsonify({"error": "Missing required fields"}), 400
     conn = create_connection()
@@ -592,8 +1017,8 @@ def deletetimetable():
             c.execute("DELETE FROM timetable WHERE id = ? AND username = ?", (id, username))
             conn.commit()
             return jsonify({"success": True, "message": "Timetable deleted successfully"}), 200
-        except Error as e:
-            print(e)
+        except Error:
+            log.exception("Database error")
             conn.rollback()
             return jsonify({"error": "Database error"}), 500
         finally:
@@ -601,21 +1026,57 @@ def deletetimetable():
     
     return jsonify({"error": "Server error"}), 500
             
-@app.route("/api/getgroups", methods=['GET'])
-def getgroups():
-    username = request.args.get('username')
-    if not username:
-        return jsonify({"error": "Missing username parameter"}), 400
+FREE_SLOT_DEFAULT_FROM = '09:00'
+FREE_SLOT_DEFAULT_TO = '18:00'
+
+@app.route("/api/freeslots", methods=['GET'])
+@require_session
+def freeslots():
+    """ Times when every member of a chat is free: ?chatId=&days=Monday,Tuesday&from=&to=&minutes= """
+    chat_id = request.args.get('chatId', type=int)
+    minutes = request.args.get('minutes', default=60, type=int)
+    if not chat_id:
+        return jsonify({"error": "Missing chatId"}), 400
+    days = [d for d in request.args.get('days', '').split(',') if d.strip()] or WEEKDAYS
+    try:
+        windows = [
+            day_range(day, request.args.get('from', FREE_SLOT_DEFAULT_FROM), request.args.get('to', FREE_SLOT_DEFAULT_TO))
+            for day in days
+        ]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    minutes = max(1, minutes)
 
     conn = create_connection()
     try:
         c = conn.cursor()
-        c.execute("SELECT id FROM users WHERE username = ?", (username,))
-        row = c.fetchone()
-        if not row:
-            return jsonify({"error": "User not found"}), 404
-        user_id = row[0]
+        if load_chat_type(c, chat_id, g.user_id) is None:
+            return jsonify({"error": "Chat not found"}), 404
+        slots = []
+        for start, end in group_free_slots(c, chat_id, windows, minutes):
+            day, start_time, end_time = format_span(start, end)
+            slots.append({
+                "day": day,
+                "start": start_time,
+                "end": end_time,
+                "start_minute": start,
+                "end_minute": end
+            })
+        return jsonify({"chat_id": chat_id, "minutes": minutes, "slots": slots}), 200
 
+    except Error:
+        log.exception("Database error")
+        return jsonify({"error": "Database error"}), 500
+    finally:
+        conn.close()
+
+@app.route("/api/getgroups", methods=['GET'])
+@require_session
+def getgroups():
+    conn = create_connection()
+    try:
+        c = conn.cursor()
+        user_id = g.user_id
         c.execute("""
             SELECT
               c.id,
@@ -634,25 +1095,101 @@ def getgroups():
             ORDER BY c.created_at DESC
         """, (user_id,))
 
-        groups = []
-        for chat_id, name, participants_csv in c.fetchall():
-            participants = participants_csv.split(',') if participants_csv else []
-            groups.append({
+        groups = (
+            {
                 "id": chat_id,
                 "name": name,
-                "participants": participants
-            })
-
-        return jsonify(groups), 200
+                "participants": participants_csv.split(',') if participants_csv else []
+            }
+            for chat_id, name, participants_csv in c
+        )
+        # stream_json closes the connection once the last group is sent
+        return stream_json(groups, close=conn.close)
 
-    except Error as e:
-        print("DB error in getgroups:", e)
+    except Error:
+        conn.close()
+        log.exception("Database error")
         return jsonify({"error": "Database error"}), 500
 
-    finally:
-        conn.close()
+TASK_UPDATE_MAX = 500
+TASK_END_MESSAGE = "Task is Ended!"
+
+TASK_COLUMNS = """
+    t.id, t.group_id, c.name, t.participant_name, t.task_name, t.deadline, t.status, t.created_at
+"""
+
+def task_dict(row):
+    return {
+        "id":              row[0],
+        "groupId":         row[1],
+        "groupName":       row[2],
+        "participantName": row[3],
+        "taskName":        row[4],
+        "deadline":        row[5],
+        "status":          row[6],
+        "createdAt":       row[7],
+    }
+
+def load_open_tasks(c, group_ids):
+    """ Map group_id -> unfinished task count from the task_progress counters """
+    c.execute(
+        "SELECT group_id, open_tasks FROM task_progress WHERE group_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(group_ids)),)
+    )
+    remaining = dict.fromkeys(group_ids, 0)
+    remaining.update(c.fetchall())
+    return remaining
+
+# Task lists per group, stored with the group's task_progress version so a
+# change made through any worker is noticed without cross-process
+# invalidation; this process's own writes also drop the entry directly.
+task_cache = ResultCache(size=4096, ttl=300)
+StatsGauges('chat_task_cache', 'Per-group task list cache', task_cache.stats)
+
+def iter_group_tasks(groups):
+    """ Yield every group's tasks by (groupName, deadline) without one combined list """
+    by_name = defaultdict(list)
+    for tasks in groups.values():
+        if tasks:
+            by_name[tasks[0]["groupName"] or ""].append(tasks)
+    for name in sorted(by_name):
+        yield from heapq.merge(*by_name[name], key=lambda task: task["deadline"])
+
+def load_group_tasks(c, user_id):
+    """ Map group_id -> task dicts for every group the user is in, reading the cache first """
+    c.execute("""
+        SELECT cp.chat_id, COALESCE(tp.version, 0)
+        FROM chat_participants cp
+        JOIN chats c ON c.id = cp.chat_id AND c.type = 'group'
+        LEFT JOIN task_progress tp ON tp.group_id = cp.chat_id
+        WHERE cp.user_id = ?
+    """, (user_id,))
+    versions = dict(c.fetchall())
+
+    groups = {}
+    for group_id, version in versions.items():
+        entry = task_cache.get(group_id)
+        if entry is not None and entry[0] == version:
+            groups[group_id] = entry[1]
+    stale = [group_id for group_id in versions if group_id not in groups]
+    if stale:
+        c.execute(f"""
+            SELECT {TASK_COLUMNS}
+            FROM tasks t
+            JOIN chats c ON t.group_id = c.id
+            WHERE t.group_id IN (SELECT value FROM json_each(?))
+            ORDER BY t.deadline
+        """, (json.dumps(stale),))
+        fresh = {group_id: [] for group_id in stale}
+        for row in c.fetchall():
+            fresh[row[1]].append(task_dict(row))
+        for group_id, tasks in fresh.items():
+            task_cache.set(group_id, (versions[group_id], tasks))
+        groups.update(fresh)
+    return groups
 
 @app.route("/api/addtasks", methods=['POST'])
+@require_session
 def addtasks():
     data = request.get_json(silent=True)
     if not data:
@@ -665,11 +1202,22 @@ def addtasks():
     for t in tasks:
         if not all(k in t for k in ('groupId','participantName','taskName','deadline')):
             return jsonify(error="Each task must include groupId, participantName, taskName, deadline"), 400
+        if isinstance(t['groupId'], bool) or not isinstance(t['groupId'], int):
+            return jsonify(error="groupId must be an integer"), 400
     
     conn = create_connection()
     try:
         c = conn.cursor()
 
+        group_ids = {t['groupId'] for t in tasks}
+        c.execute("""
+            SELECT cp.chat_id FROM chat_participants cp
+            WHERE cp.user_id = ? AND cp.chat_id IN (SELECT value FROM json_each(?))
+        """, (g.user_id, json.dumps(list(group_ids))))
+        unknown = group_ids - {row[0] for row in c.fetchall()}
+        if unknown:
+            return jsonify(error=f"Group not found: {', '.join(map(str, sorted(unknown)))}"), 404
+
         group_id = tasks[0]['groupId']
         c.execute(
             "SELECT task_name FROM tasks WHERE group_id = ?",
@@ -695,11 +1243,29 @@ def addtasks():
             "INSERT OR IGNORE INTO tasks (group_id, participant_name, task_name, deadline) VALUES (?, ?, ?, ?)",
             rows
         )
+        c.execute(f"""
+            SELECT {TASK_COLUMNS}
+            FROM tasks t
+            JOIN chats c ON t.group_id = c.id
+            WHERE (t.group_id, t.task_name) IN (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+            )
+        """, (json.dumps([[r[0], r[2]] for r in rows]),))
+        added = [task_dict(row) for row in c.fetchall()]
+        remaining = load_open_tasks(c, {t["groupId"] for t in added})
         conn.commit()
+
+        for group_id, remaining_tasks in remaining.items():
+            task_cache.invalidate(group_id)
+            emit_to_room('tasks_changed', {
+                'group_id': group_id,
+                'added': [t for t in added if t["groupId"] == group_id],
+                'remaining': remaining_tasks,
+            }, f"chat_{group_id}")
         return jsonify(success=True, message="Tasks added successfully"), 201
 
-    except Error as e:
-        print("DB error in addtasks:", e)
+    except Error:
+        log.exception("Database error")
         conn.rollback()
         return jsonify(error="Database error"), 500
 
@@ -707,126 +1273,102 @@ def addtasks():
         conn.close()
 
 @app.route("/api/gettasks", methods=['GET'])
+@require_session
 def gettasks():
-    username = request.args.get('username')
-    if not username:
-        return jsonify({"error": "Missing username"}), 400
-
     conn = create_connection()
     try:
         c = conn.cursor()
-        c.execute("SELECT id FROM users WHERE username = ?", (username,))
-        row = c.fetchone()
-        if not row:
-            return jsonify({"error": "User not found"}), 404
-        user_id = row[0]
+        # Each group's list is cached in deadline order, so this only merges
+        return stream_json(iter_group_tasks(load_group_tasks(c, g.user_id)))
 
-        c.execute("""
-            SELECT cp.chat_id
-            FROM chat_participants cp
-            JOIN chats c ON cp.chat_id = c.id
-            WHERE cp.user_id = ? AND c.type = 'group'
-        """, (user_id,))
-        group_ids = [r[0] for r in c.fetchall()]
-
-        if not group_ids:
-            return jsonify([]), 200
-        placeholders = ",".join("?" for _ in group_ids)
-        query = f"""
-            SELECT
-              t.id,
-              t.group_id     AS groupId,
-              c.name         AS groupName,
-              t.participant_name AS participantName,
-              t.task_name    AS taskName,
-              t.deadline     AS deadline,
-              t.status       AS status,
-              t.created_at   AS createdAt
-            FROM tasks t
-            JOIN chats c ON t.group_id = c.id
-            WHERE t.group_id IN ({placeholders})
-            ORDER BY c.name, t.deadline
-        """
-        c.execute(query, group_ids)
-
-        result = [
-            {
-              "id":                row[0],
-              "groupId":           row[1],
-              "groupName":         row[2],
-              "participantName":   row[3],
-              "taskName":          row[4],
-              "deadline":          row[5],
-              "status":            row[6],
-              "createdAt":         row[7],
-            }
-            for row in c.fetchall()
-        ]
-        print(result)
-        return jsonify(result), 200
-
-    except Error as e:
-        print("DB error in gettasks:", e)
+    except Error:
+        log.exception("Database error")
         return jsonify({"error": "Database error"}), 500
 
     finally:
         conn.close()
 
 @app.route("/api/updatetaskstatus", methods=['PATCH'])
+@require_session
 def updatetaskstatus():
+    """ Set the status of one task (taskId) or many (taskIds) in one transaction """
     data = request.get_json(silent=True)
     if not data:
         return jsonify(error="Invalid JSON"), 400
 
-    task_id  = data.get('taskId')
-    new_stat = data.get('status') 
-    username = data.get('username')
-    if not task_id or not new_stat or not username:
+    task_ids = data.get('taskIds')
+    if task_ids is None and data.get('taskId'):
+        task_ids = [data.get('taskId')]
+    new_stat = data.get('status')
+    username = g.username
+    if not task_ids or not isinstance(task_ids, list) or not new_stat:
         return jsonify(error="Missing required fields"), 400
+    if len(task_ids) > TASK_UPDATE_MAX:
+        return jsonify(error=f"At most {TASK_UPDATE_MAX} tasks per request"), 400
+    try:
+        task_ids = sorted({int(task_id) for task_id in task_ids})
+    except (TypeError, ValueError):
+        return jsonify(error="Task ids must be integers"), 400
 
     conn = create_connection()
     try:
         c = conn.cursor()
-        c.execute(
-            "UPDATE tasks SET status = ? WHERE id = ?",
-            (new_stat, task_id)
-        )
-        conn.commit()
-        c.execute("SELECT group_id FROM tasks WHERE id = ?", (task_id,))
-        row = c.fetchone()
-        if not row:
+        # task_progress triggers adjust each group's open count as rows change
+        c.execute("""
+            UPDATE tasks SET status = ?
+            WHERE id IN (SELECT value FROM json_each(?))
+              AND group_id IN (SELECT chat_id FROM chat_participants WHERE user_id = ?)
+            RETURNING id, group_id
+        """, (new_stat, json.dumps(task_ids), g.user_id))
+        updated = c.fetchall()
+        if not updated:
+            conn.rollback()
             return jsonify(error="Task not found"), 404
-        group_id = row[0]
 
-        c.execute(
-            "SELECT COUNT(*) FROM tasks WHERE group_id = ? AND status != 'Finished'",
-            (group_id,)
-        )
-        remaining = c.fetchone()[0]
-
-        if remaining == 0:
-            c.execute("DELETE FROM tasks WHERE group_id = ?", (group_id,))
-            c.execute("SELECT id FROM users WHERE username = ?", (username,))
-            c.execute("""
-                INSERT INTO plainmessages
-                  (chat_id, sender_id, content)
-                VALUES (?, ?, ?)
-            """, (group_id, username, "Task is Ended!"))
-            conn.commit()
-
-        return jsonify(success=True), 200
+        remaining = load_open_tasks(c, {group_id for _, group_id in updated})
+        ended = [group_id for group_id, open_tasks in remaining.items() if open_tasks == 0]
+        c.executemany("DELETE FROM tasks WHERE group_id = ?", [(group_id,) for group_id in ended])
+        # The end message commits with the deletion, so neither can happen alone
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        end_messages = []
+        for group_id in ended:
+            c.execute(
+                "INSERT INTO plainmessages (chat_id, sender_id, content, timestamp) VALUES (?, ?, ?, ?)",
+                (group_id, username, TASK_END_MESSAGE, timestamp)
+            )
+            end_messages.append((group_id, c.lastrowid))
+        conn.commit()
 
-    except Error as e:
+    except Error:
         conn.rollback()
-        print("DB error in updatetaskstatus:", e)
+        log.exception("Database error")
         return jsonify(error="Database error"), 500
 
     finally:
         conn.close()
 
+    for group_id, open_tasks in remaining.items():
+        task_cache.invalidate(group_id)
+        emit_to_room('tasks_changed', {
+            'group_id': group_id,
+            'updated': [{'id': task_id, 'status': new_stat} for task_id, gid in updated if gid == group_id],
+            'remaining': open_tasks,
+            'ended': group_id in ended,
+        }, f"chat_{group_id}")
+    for group_id, message_id in end_messages:
+        recent_messages.append(
+            "plainmessages", group_id, (message_id, username, TASK_END_MESSAGE, timestamp))
+        emit_plain_message(group_id, message_id, username, TASK_END_MESSAGE, timestamp)
+
+    return jsonify(
+        success=True,
+        updated=[task_id for task_id, _ in updated],
+        missing=sorted(set(task_ids) - {task_id for task_id, _ in updated}),
+        ended=ended
+    ), 200
+
 
 if __name__ == "__main__":
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    context.minimum_version = ssl.TLSVersion.TLSv1_2
-    context.load_cert_chain('localhost+2.pem', 'localhost+2-key.pem')
-    socketio.run(app, port=8000, debug=True, ssl_context=context)
+    # Threaded development server; use run.py for the eventlet/gevent modes
+    from run import parse_args, serve
+    serve(app, socketio, parse_args())
@@ -0,0 +1,162 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from sqlite3 import Error
+
+from flask import g, jsonify, request
+
+from db import PoolTimeout, pool
+from logs import get_logger
+
+log = get_logger('sessions')
+
+SESSION_TTL = int(os.environ.get('CHAT_APP_SESSION_TTL', str(7 * 24 * 3600)))
+# A logout only clears this process's cache; other workers keep accepting
+# the token until their cached entry ages out, so this TTL is the longest a
+# revoked token can still work there
+CACHE_TTL = int(os.environ.get('CHAT_APP_SESSION_CACHE_TTL', '30'))
+CACHE_SIZE = int(os.environ.get('CHAT_APP_SESSION_CACHE_SIZE', '10000'))
+# Expired rows are deleted on every Nth login or signup
+PURGE_EVERY = int(os.environ.get('CHAT_APP_SESSION_PURGE_EVERY', '500'))
+
+
+class SessionStore:
+    """ Session tokens written through to SQLite and served from an LRU/TTL cache """
+
+    def __init__(self, pool, ttl=SESSION_TTL, cache_ttl=CACHE_TTL, cache_size=CACHE_SIZE,
+                 purge_every=PURGE_EVERY):
+        self.pool = pool
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.purge_every = purge_every
+        self._created = 0
+        self.purged = 0
+        # token -> (user_id, username, session expiry, cache entry expiry)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, token, user_id, username, expires_at):
+        now = time.time()
+        with self._lock:
+            self._cache[token] = (user_id, username, expires_at, min(expires_at, now + self.cache_ttl))
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def create(self, user_id, username):
+        """ Mint a token for the user and persist it """
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + self.ttl
+        conn = self.pool.acquire()
+        try:
+            conn.execute(
+                "INSERT INTO sessions (token, user_id, username, expires_at) VALUES (?, ?, ?, ?)",
+                (token, user_id, username, expires_at)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._remember(token, user_id, username, expires_at)
+        with self._lock:
+            self._created += 1
+            purge = self.purge_every > 0 and self._created % self.purge_every == 1
+        if purge:
+            try:
+                self.purged += self.purge_expired()
+            except Error:
+                log.exception("Could not purge expired sessions")
+        return token
+
+    def resolve(self, token):
+        """ Return (user_id, username) for a live token, or None """
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None:
+                user_id, username, expires_at, cached_until = entry
+                if now < cached_until:
+                    self._cache.move_to_end(token)
+                    self.hits += 1
+                    return user_id, username
+                del self._cache[token]
+            self.misses += 1
+
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute(
+                "SELECT user_id, username, expires_at FROM sessions WHERE token = ?",
+                (token,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row or row[2] <= now:
+            return None
+        user_id, username, expires_at = row
+        self._remember(token, user_id, username, expires_at)
+        return user_id, username
+
+    def revoke(self, token):
+        """ Delete a token from the cache and the table """
+        with self._lock:
+            self._cache.pop(token, None)
+        conn = self.pool.acquire()
+        try:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def purge_expired(self):
+        """ Drop expired sessions from the table; returns the number removed """
+        conn = self.pool.acquire()
+        try:
+            cur = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses, "purged": self.purged}
+
+
+sessions = SessionStore(pool)
+
+
+def bearer_token():
+    """ Token from the Authorization: Bearer header, if any """
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return token.strip()
+
+
+def require_session(view):
+    """ Resolve the caller's session once and expose it as g.user_id / g.username """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = bearer_token()
+        if not token:
+            return jsonify({"error": "Not authenticated"}), 401
+        try:
+            session = sessions.resolve(token)
+        except PoolTimeout:
+            # Answered as 503 by the app's errorhandler
+            raise
+        except Error:
+            log.exception("Database error resolving session")
+            return jsonify({"error": "Database error"}), 500
+        if session is None:
+            return jsonify({"error": "Session expired or invalid"}), 401
+        g.user_id, g.username = session
+        g.session_token = token
+        return view(*args, **kwargs)
+    return wrapper
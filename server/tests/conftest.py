@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The server modules import each other flat, as they do when run from server/
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
@@ -0,0 +1,63 @@
+import sqlite3
+
+from archive import Archiver, archive_once, archive_table, merge_archived
+from chat_queries import load_message_rows
+from migrations import run_migrations
+
+
+def _page(conn, chat_id, before=None, limit=4):
+    c = conn.cursor()
+    rows, has_more = load_message_rows(c, chat_id, 'group', before, None, limit)
+    rows, has_more = merge_archived(c, 'plainmessages', chat_id, before, None, limit, rows, has_more)
+    return [row[2] for row in rows], has_more
+
+
+def test_full_live_page_reports_archived_history(tmp_path):
+    path = str(tmp_path / 'chat_app.db')
+    run_migrations(path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, username, salt, password, public_key) VALUES (1, 'ann', '', '', '')")
+    conn.execute("INSERT INTO chats (id, name, type) VALUES (1, 'g', 'group')")
+    conn.execute("INSERT INTO chat_participants (chat_id, user_id) VALUES (1, 1)")
+    # m1..m6 are years old, m7..m10 recent
+    conn.executemany(
+        "INSERT INTO plainmessages (chat_id, sender_id, content, timestamp) VALUES (1, 'ann', ?, ?)",
+        [(f'm{i}', '2020-01-01 00:00:00' if i <= 6 else '2999-01-01 00:00:00') for i in range(1, 11)]
+    )
+    conn.commit()
+    moved = archive_once(path, days=30, directory=str(tmp_path / 'archive'))
+    assert moved['plainmessages'] == 6
+
+    assert _page(conn, 1) == (['m7', 'm8', 'm9', 'm10'], True)
+    assert _page(conn, 1, before=9, limit=2) == (['m7', 'm8'], True)
+    assert _page(conn, 1, before=7, limit=4) == (['m3', 'm4', 'm5', 'm6'], True)
+    assert _page(conn, 1, before=3, limit=4) == (['m1', 'm2'], False)
+    conn.close()
+
+
+def test_segment_rows_are_not_double_counted(tmp_path):
+    path = str(tmp_path / 'chat_app.db')
+    run_migrations(path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, username, salt, password, public_key) VALUES (1, 'ann', '', '', '')")
+    conn.execute("INSERT INTO chats (id, name, type) VALUES (1, 'g', 'group')")
+    conn.executemany(
+        "INSERT INTO plainmessages (chat_id, sender_id, content, timestamp) VALUES (1, 'ann', ?, '2020-01-01')",
+        [(f'm{i}',) for i in range(5)]
+    )
+    conn.commit()
+    directory = str(tmp_path / 'archive')
+    # A second process copying the same batch before the first deleted it
+    assert archive_table(conn, 'plainmessages', '2021-01-01', directory) == 5
+    conn.execute("INSERT INTO plainmessages (id, chat_id, sender_id, content, timestamp) VALUES (3, 1, 'ann', 'm2', '2020-01-01')")
+    conn.commit()
+    archive_table(conn, 'plainmessages', '2021-01-01', directory)
+    assert conn.execute("SELECT min_id, max_id, rows FROM archive_segments").fetchall() == [(1, 5, 5)]
+    conn.close()
+
+
+def test_only_one_archiver_per_directory(tmp_path):
+    first = Archiver(directory=str(tmp_path))
+    second = Archiver(directory=str(tmp_path))
+    assert first._claim()
+    assert not second._claim()
@@ -0,0 +1,81 @@
+import sqlite3
+import subprocess
+import sys
+import time
+
+from conftest import SERVER_DIR
+from e2ee_codec import unpack
+from migrations import MIGRATIONS, run_migrations
+from timetable import MAX_SLOT_MINUTES
+
+WORKERS = 6
+
+# Every worker waits for the same instant, then migrates the same fresh file
+WORKER = '''
+import sys, time
+from migrations import run_migrations
+time.sleep(max(0, float(sys.argv[2]) - time.time()))
+run_migrations(sys.argv[1])
+'''
+
+
+def test_concurrent_workers_migrate_once(tmp_path):
+    path = str(tmp_path / 'chat_app.db')
+    start = time.time() + 2
+    procs = [
+        subprocess.Popen(
+            [sys.executable, '-c', WORKER, path, str(start)],
+            cwd=SERVER_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        for _ in range(WORKERS)
+    ]
+    for proc in procs:
+        _, err = proc.communicate(timeout=120)
+        assert proc.returncode == 0, err.decode()
+
+    conn = sqlite3.connect(path)
+    versions = [row[0] for row in conn.execute("SELECT version FROM schema_migrations ORDER BY version")]
+    conn.close()
+    assert versions == sorted(version for version, _, _ in MIGRATIONS)
+
+
+def test_legacy_e2ee_rows_that_are_not_base64(tmp_path):
+    path = str(tmp_path / 'chat_app.db')
+    run_migrations(path, [m for m in MIGRATIONS if m[0] < 6])
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, username, salt, password, public_key) VALUES (1, 'ann', '', '', '')")
+    conn.execute("INSERT INTO chats (id, name, type) VALUES (1, 'p', 'private')")
+    conn.executemany(
+        "INSERT INTO e2eemessages (chat_id, sender_id, iv, ct, tag) VALUES (1, 'ann', ?, ?, ?)",
+        [('AAAAAAAAAAAAAAAAAAAAAA==', 'AAAA', 'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA='),
+         ('not base64!', 'AAAA', 'AAAA')]
+    )
+    conn.commit()
+
+    run_migrations(path)
+    rows = conn.execute("SELECT id, payload FROM e2eemessages ORDER BY id").fetchall()
+    conn.close()
+    assert [row[0] for row in rows] == [1, 2]
+    assert unpack(rows[1][1]) == (b'not base64!', b'AAAA', b'AAAA')
+
+
+def test_legacy_timetable_slots_are_split_to_the_cap(tmp_path):
+    path = str(tmp_path / 'chat_app.db')
+    run_migrations(path, [m for m in MIGRATIONS if m[0] < 11])
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO timetable (username, day, time, duration, content) VALUES ('ann', 'Monday', '20:00', 30, 'x')"
+    )
+    conn.commit()
+
+    run_migrations(path)
+    rows = conn.execute(
+        "SELECT day, time, duration, content, start_minute, end_minute FROM timetable ORDER BY start_minute"
+    ).fetchall()
+    conn.close()
+    assert rows == [
+        ('Monday', '20:00', 12, 'x', 1200, 1920),
+        ('Tuesday', '08:00', 12, 'x', 1920, 2640),
+        ('Tuesday', '20:00', 6, 'x', 2640, 3000),
+    ]
+    assert all(end - start <= MAX_SLOT_MINUTES for *_, start, end in rows)
@@ -0,0 +1,132 @@
+import re
+
+# Timetable slots are half-open [start, end) intervals in minutes since
+# Monday 00:00. Rows keep their day/time/duration text for clients, plus
+# start_minute/end_minute for indexed range, overlap and free-slot queries.
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+WEEKDAYS = DAYS[:5]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Durations are whole hours; the cap bounds how far back an overlapping
+# slot can start, which keeps the conflict check to a short index range.
+# Longer legacy rows are split into capped pieces by the migrations.
+MAX_DURATION_HOURS = 12
+MAX_SLOT_MINUTES = MAX_DURATION_HOURS * 60
+
+TIME = re.compile(r'^(\d{1,2})(?::(\d{2}))?$')
+
+
+def day_index(day):
+    try:
+        return DAYS.index(str(day).strip().capitalize())
+    except ValueError:
+        raise ValueError(f"Unknown day: {day}")
+
+
+def minute_of_day(text):
+    """ Minutes since midnight for 'HH:MM' or 'HH'; '24:00' is the end of the day """
+    match = TIME.match(str(text).strip())
+    if not match:
+        raise ValueError(f"Invalid time: {text}")
+    hours, minutes = int(match.group(1)), int(match.group(2) or 0)
+    if minutes >= 60 or hours > 24 or (hours == 24 and minutes):
+        raise ValueError(f"Invalid time: {text}")
+    return hours * 60 + minutes
+
+
+def format_span(start, end):
+    """ (day, 'HH:MM', 'HH:MM') for an interval, with the end counted from the start's day """
+    day, offset = divmod(start, MINUTES_PER_DAY)
+    end_offset = end - day * MINUTES_PER_DAY
+    return (
+        DAYS[day],
+        f"{offset // 60:02d}:{offset % 60:02d}",
+        f"{end_offset // 60:02d}:{end_offset % 60:02d}",
+    )
+
+
+def slot_minutes(day, time, duration):
+    """ (start, end) minute-of-week for a slot; raises ValueError if it is invalid """
+    try:
+        # int() of the text rejects 1.5, "1.5" and True alike
+        hours = int(str(duration).strip())
+    except ValueError:
+        raise ValueError("Duration must be a whole number of hours")
+    if not 1 <= hours <= MAX_DURATION_HOURS:
+        raise ValueError(f"Duration must be between 1 and {MAX_DURATION_HOURS} hours")
+    start = day_index(day) * MINUTES_PER_DAY + minute_of_day(time)
+    end = start + hours * 60
+    if end > MINUTES_PER_WEEK:
+        raise ValueError("Slot runs past the end of the week")
+    return start, end
+
+
+def day_range(day, start=None, end=None):
+    """ (start, end) minute-of-week for a window such as Tuesday 09:00-12:00 """
+    base = day_index(day) * MINUTES_PER_DAY
+    lo = minute_of_day(start) if start else 0
+    hi = minute_of_day(end) if end else MINUTES_PER_DAY
+    if lo >= hi:
+        raise ValueError("Range end must be after its start")
+    return base + lo, base + hi
+
+
+def find_conflict(c, username, start, end):
+    """ The user's first slot overlapping [start, end) as (id, start, end), or None """
+    # Anything overlapping must start within MAX_SLOT_MINUTES before end
+    c.execute("""
+        SELECT id, start_minute, end_minute
+        FROM timetable
+        WHERE username = ? AND start_minute > ? AND start_minute < ? AND end_minute > ?
+        ORDER BY start_minute
+        LIMIT 1
+    """, (username, start - MAX_SLOT_MINUTES, end, start))
+    return c.fetchone()
+
+
+def merge_intervals(intervals):
+    """ Union of (start, end) intervals as a sorted list of disjoint ones """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def free_intervals(busy, start, end, min_minutes=0):
+    """ Gaps of at least min_minutes inside [start, end) not covered by merged busy intervals """
+    free = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_end <= cursor:
+            continue
+        if busy_start >= end:
+            break
+        if busy_start - cursor >= max(min_minutes, 1):
+            free.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if end - cursor >= max(min_minutes, 1):
+        free.append((cursor, end))
+    return free
+
+
+def group_free_slots(c, chat_id, windows, min_minutes=60):
+    """ Free intervals common to every member of a chat, within each (start, end) window """
+    lo = min(start for start, _ in windows)
+    hi = max(end for _, end in windows)
+    c.execute("""
+        SELECT t.start_minute, t.end_minute
+        FROM chat_participants cp
+        JOIN users u ON u.id = cp.user_id
+        JOIN timetable t ON t.username = u.username
+        WHERE cp.chat_id = ? AND t.start_minute > ? AND t.start_minute < ? AND t.end_minute > ?
+    """, (chat_id, lo - MAX_SLOT_MINUTES, hi, lo))
+    busy = merge_intervals(c.fetchall())
+    slots = []
+    for start, end in sorted(windows):
+        slots.extend(free_intervals(busy, start, end, min_minutes))
+    return slots
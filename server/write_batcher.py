@@ -0,0 +1,227 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from db import DB_PATH, PRAGMAS
+from logs import get_logger
+from offload import run_blocking
+
+log = get_logger('write_batcher')
+
+# Concurrent message inserts are queued and committed together, so one WAL
+# fsync covers a whole burst instead of one per POST. Callers block until
+# their row's transaction has committed with synchronous=FULL, so an
+# acknowledged message is durable.
+WRITE_BATCH_SIZE = int(os.environ.get('CHAT_APP_WRITE_BATCH_SIZE', '256'))
+WRITE_BATCH_DELAY = float(os.environ.get('CHAT_APP_WRITE_BATCH_DELAY_MS', '5')) / 1000
+WRITE_QUEUE_LIMIT = int(os.environ.get('CHAT_APP_WRITE_QUEUE_LIMIT', '5000'))
+WRITE_TIMEOUT = float(os.environ.get('CHAT_APP_WRITE_TIMEOUT', '5'))
+
+
+def _buckets(text):
+    """ Sorted bucket bounds from a comma-separated list such as '1,2,5' """
+    bounds = (float(part) for part in text.split(',') if part.strip())
+    return tuple(sorted(int(bound) if bound.is_integer() else bound for bound in bounds))
+
+
+# Upper bounds of the flush-latency histogram, in milliseconds
+FLUSH_BUCKETS_MS = _buckets(os.environ.get('CHAT_APP_WRITE_FLUSH_BUCKETS_MS', '1,2,5,10,25,50,100,250,1000'))
+
+
+class BatcherSaturated(Exception):
+    """ Raised when the write queue already holds its limit of pending rows """
+
+
+class WriteTimedOut(BatcherSaturated):
+    """ Raised when a queued row was withdrawn after waiting past the timeout; it was not written """
+
+
+class PendingWrite:
+    def __init__(self, sql, params, on_commit=None):
+        self.sql = sql
+        self.params = params
+        self.on_commit = on_commit
+        self.lastrowid = None
+        self.error = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self.claimed = False
+        self.cancelled = False
+
+    def claim(self):
+        """ Called by the writer before flushing; False if the caller already gave up """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.claimed = True
+            return True
+
+    def cancel(self):
+        """ Withdraw a row the writer has not picked up; False if it is already being flushed """
+        with self._lock:
+            if self.claimed:
+                return False
+            self.cancelled = True
+            return True
+
+
+class WriteBatcher:
+    """ Group-commit queue for single-row INSERTs on a dedicated connection """
+
+    def __init__(self, path=DB_PATH, batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY,
+                 queue_limit=WRITE_QUEUE_LIMIT, timeout=WRITE_TIMEOUT):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=queue_limit)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+        self._flush_buckets = [0] * (len(FLUSH_BUCKETS_MS) + 1)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute("PRAGMA synchronous = FULL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def write(self, sql, params, on_commit=None):
+        """ Queue one INSERT and wait until it is committed; returns its lastrowid.
+
+        ``on_commit(lastrowid)`` runs on the writer thread after the commit,
+        in row order, before the caller is woken. A row still queued after
+        the timeout is withdrawn and WriteTimedOut raised, so a retry cannot
+        duplicate it.
+        """
+        if self._thread is None:
+            self._start()
+        pending = PendingWrite(sql, params, on_commit)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise BatcherSaturated("Message write queue is full")
+        if not pending.done.wait(self.timeout):
+            if pending.cancel():
+                with self._lock:
+                    self._timeouts += 1
+                raise WriteTimedOut("Message write timed out before it was flushed")
+            # Already inside a transaction: its outcome is moments away, and
+            # giving up now could hide a committed row from a retrying client
+            if not pending.done.wait(self.timeout):
+                raise sqlite3.OperationalError("Timed out waiting for message write to commit")
+        if pending.error is not None:
+            raise pending.error
+        return pending.lastrowid
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        if self._conn is None:
+            self._conn = self._connect()
+        c = self._conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for pending in batch:
+                # A savepoint per row keeps one bad row from failing the batch
+                c.execute("SAVEPOINT row")
+                try:
+                    c.execute(pending.sql, pending.params)
+                    pending.lastrowid = c.lastrowid
+                    c.execute("RELEASE row")
+                except sqlite3.Error as e:
+                    c.execute("ROLLBACK TO row")
+                    c.execute("RELEASE row")
+                    pending.error = e
+            c.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self._conn.in_transaction:
+                c.execute("ROLLBACK")
+            for pending in batch:
+                pending.lastrowid = None
+                pending.error = e
+
+    def _run(self):
+        while True:
+            batch = [pending for pending in self._collect() if pending.claim()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                run_blocking(self._flush, batch)
+            except sqlite3.Error as e:
+                for pending in batch:
+                    pending.error = e
+            self._record(batch, time.perf_counter() - start)
+            for pending in batch:
+                if pending.on_commit is not None and pending.error is None:
+                    try:
+                        pending.on_commit(pending.lastrowid)
+                    except Exception:
+                        log.exception("on_commit callback failed")
+                pending.done.set()
+
+    def _record(self, batch, elapsed):
+        failed = sum(1 for pending in batch if pending.error is not None)
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            self._batches += 1
+            self._rows += len(batch) - failed
+            self._failed += failed
+            self._flush_total += elapsed
+            self._flush_max = max(self._flush_max, elapsed)
+            for i, bound in enumerate(FLUSH_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    self._flush_buckets[i] += 1
+                    break
+            else:
+                self._flush_buckets[-1] += 1
+
+    def stats(self):
+        """ Snapshot of queue depth, batch sizes and the flush-latency histogram """
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "batches": self._batches,
+                "rows": self._rows,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "avg_batch_size": (self._rows + self._failed) / self._batches if self._batches else 0.0,
+                "flush_seconds_total": self._flush_total,
+                "flush_seconds_max": self._flush_max,
+                "flush_ms_buckets": dict(zip(FLUSH_BUCKETS_MS + ("+Inf",), self._flush_buckets)),
+            }
+
+
+message_writer = WriteBatcher()